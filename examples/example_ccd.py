@@ -12,6 +12,7 @@ from lib.basis import *
 from lib.hamiltonian import *
 from lib.fci import *
 from lib.ccd import *
+from lib.sweep import *
 
 
 def main():
@@ -25,19 +26,10 @@ def main():
     basis = Basis(p_max, delta, n)
 
     e_ref_list = 2.0 - g_list
-    e_fci = np.zeros_like(g_list)
-    e_ccd = np.zeros_like(g_list)
-    for i, g in enumerate(g_list):
-        hamiltonian = Hamiltonian(basis, g)
-
-        fci = FCI(basis, hamiltonian, n)
-        fci.build_configurations()
-        fci.build_hamiltonian_matrix()
-        fci.solve()
-        e_fci[i] = fci.emin
-
-        ccd = CCD(basis)
-        e_ccd[i] = ccd.get_ccd(g)
+    # the points are spread over all cores, each continuing from its neighbour (FCI ground state, CCD amplitudes)
+    sweep = Sweep(g_list)
+    e_fci = np.array(sweep.run(FCISolver(basis, n)), dtype=float)
+    e_ccd = np.array(sweep.run(CCDSolver(basis)), dtype=float)
     print(g_list.tolist())
     print(e_fci.tolist())
     print(e_ccd.tolist())
@@ -17,12 +17,22 @@ from lib.fciqmc import *
 params = {}
 params["initial_walkers"] = 10
 params["target_walker_number"] = 1000
-params["d_tau"] = 1e-2
+params["d_tau"] = 1e-2  # or "auto": half the critical 2 / (E_max - E_0) from SpectralBounds
+params["d_tau_control"] = False  # adapt d_tau to the spawn amplitudes during warm up and until the reblocking starts
+params["bloom_limit"] = 1.0  # walkers allowed in the bloom_percentile (default 99) percentile spawn, at most bloom_max (default 10) in any spawn
 params["A"] = 10
 params["xi"] = 0.1
 params["zeta"] = 0.01
 params["steps"] = 3000
-params["initiator_threshold"] = 1
+params["initiator_threshold"] = 1  # or "auto"
+params["excitation"] = "uniform"  # "uniform", "symmetric" or "heat_bath"
+params["core_space"] = None  # semi-stochastic core: None, "doubles" or the number K of most populated determinants
+params["checkpoint_file"] = None  # e.g. "./result/fciqmc.ckpt", written every params["checkpoint_interval"] steps
+params["trace_path"] = None  # e.g. "./result/fciqmc_trace" to stream the samples to column files instead of memory
+params["reblock_start"] = 0.5  # fraction of the steps after which samples enter the online reblocking analysis
+params["target_error"] = None  # e.g. 1e-3: stop once the reblocked error of E is this small, steps is then an upper bound
+params["equilibration_steps"] = None  # with target_error: step after which samples enter the reblocking (default 5 A / xi)
+params["time_limit"] = None  # e.g. 3600: stop after this many seconds, with a checkpoint to resume from
 
 
 def main():
@@ -91,9 +101,10 @@ def main():
     plt.title("pairing model", fontsize=9)
     plt.xlabel(r"$\tau\; \mathrm{[a.u.]}$", fontsize=9)
     plt.ylabel(r"$E\; \mathrm{[a.u.]}$", fontsize=9)
-    plt.hlines(fci.emin, min(fciqmc.tau_trace), max(fciqmc.tau_trace), color="black", linestyle="--", linewidth=0.7, zorder=2, label=r"FCI")
-    plt.plot(fciqmc.tau_trace, fciqmc.shift_trace, c="C2", linewidth=0.7, zorder=0, label=r"$S(\tau)$")
-    plt.plot(fciqmc.tau_trace, fciqmc.energy_trace, c="C3", linewidth=0.7, zorder=1, label=r"$E(\tau)$")
+    tau = fciqmc.trace.column("tau")
+    plt.hlines(fci.emin, tau.min(), tau.max(), color="black", linestyle="--", linewidth=0.7, zorder=2, label=r"FCI")
+    plt.plot(tau, fciqmc.trace.column("S"), c="C2", linewidth=0.7, zorder=0, label=r"$S(\tau)$")
+    plt.plot(tau, fciqmc.trace.energy(), c="C3", linewidth=0.7, zorder=1, label=r"$E(\tau)$")
     bwith = 0.7
     tk = plt.gca()
     tk.spines["bottom"].set_linewidth(bwith)
@@ -12,6 +12,7 @@ from lib.basis import *
 from lib.hamiltonian import *
 from lib.fci import *
 from lib.mbpt import *
+from lib.sweep import *
 
 
 def main():
@@ -25,25 +26,14 @@ def main():
     basis = Basis(p_max, delta, n)
 
     e_ref_list = 2.0 - g_list
-    e_fci = np.zeros_like(g_list)
+    # the points are spread over all cores, FCI continues from the ground state of the neighbouring point
+    sweep = Sweep(g_list)
+    e_fci = np.array(sweep.run(FCISolver(basis, n)), dtype=float)
     # independent correlation energy from MBPT
-    e_part_mbpt2 = np.zeros_like(g_list)
-    e_part_mbpt3 = np.zeros_like(g_list)
+    e_part_mbpt = np.array(sweep.run(MBPTSolver(basis)))
+    e_part_mbpt2 = e_part_mbpt[:, 0]
+    e_part_mbpt3 = e_part_mbpt[:, 1]
     # e_part_mbpt4 = np.zeros_like(g_list)
-    for i, g in enumerate(g_list):
-        print("calculating for g =", g)
-        hamiltonian = Hamiltonian(basis, g)
-
-        fci = FCI(basis, hamiltonian, n)
-        fci.build_configurations()
-        fci.build_hamiltonian_matrix()
-        fci.solve()
-        e_fci[i] = fci.emin
-
-        mbpt = MBPT(basis, hamiltonian)
-        e_part_mbpt2[i] = mbpt.cal_coor2(g)
-        e_part_mbpt3[i] = mbpt.cal_coor3(g)
-        # e_part_mbpt4[i] = mbpt.cal_coor4(g)
     e_mbpt2 = e_part_mbpt2
     e_mbpt3 = e_part_mbpt2 + e_part_mbpt3
     # e_mbpt4 = e_part_mbpt2 + e_part_mbpt3 + e_part_mbpt4
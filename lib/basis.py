@@ -1,9 +1,40 @@
 import itertools
-from typing import List, Tuple, Iterable
+import math
+from typing import List, Tuple, Iterable, Optional
 from collections import defaultdict
 import random
+import numpy as np
 
 from .orbit import *
+from .bitstring import *
+
+
+# (i, j) with 0 <= i < j < m for every x-th (0-based) pair in itertools.combinations(range(m), 2) order
+def combination_2_batch(m: int, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # count pairs from the end: the last row (i = m - 2) holds 1 pair, the one before 2, ...
+    y = m * (m - 1) // 2 - 1 - x
+    r = ((np.sqrt(8 * y + 1) - 1) // 2).astype(np.int64)
+    r += (r + 1) * (r + 2) // 2 <= y  # guard against rounding of sqrt
+    r -= r * (r + 1) // 2 > y
+    i = m - 2 - r
+    j = m - 1 - (y - r * (r + 1) // 2)
+    return (i, j)
+
+
+# occupied orbitals of a bitstring, in ascending order
+def occupied_indices(bits: int) -> np.ndarray:
+    indices = []
+    while bits:
+        low = bits & -bits
+        indices.append(low.bit_length() - 1)
+        bits ^= low
+    return np.array(indices, dtype=np.int64)
+
+
+# number of set bits of bits strictly between orbitals i and j
+def count_between(bits: int, i: int, j: int) -> int:
+    lo, hi = min(i, j), max(i, j)
+    return ((bits >> (lo + 1)) & ((1 << (hi - lo - 1)) - 1)).bit_count() if hi > lo else 0
 
 
 class Det:
@@ -62,11 +93,10 @@ class Det:
     def find_nth(self, n: int) -> int:
         if n <= 0:
             return self.nmo
-        count = 0
-        for i in range(self.nmo):
-            if self.is_occupied(i) and (count := count + 1) == n:
-                return i
-        return self.nmo
+        bits = self.bits
+        for _ in range(n - 1):
+            bits &= bits - 1
+        return (bits & -bits).bit_length() - 1 if bits else self.nmo
 
     def copy(self) -> "Det":
         return Det(self.get_occupied_indices(), self.nmo)
@@ -99,6 +129,9 @@ class Det:
 
 
 class Basis:
+    # share of single excitations drawn by the uniform excitation generator
+    onebody_probability: float = 0.5
+
     def __init__(self, p_max: int, delta: float = 1, n: int = 4):
         self.p_max: int = p_max
         self.delta: float = delta
@@ -125,6 +158,14 @@ class Basis:
         self.two_body_state_channel_positions = []
         # build states connections, which is important for fciqmc algorithm
         self.build_connections()
+        # build channel bitmasks, which drive the excitation generator
+        self.one_body_channel_masks: List[int] = []
+        self.two_body_channel_blocks: List[List[Tuple[int, int]]] = []
+        self.two_body_channel_table: List[List[int]] = []
+        self.build_channel_masks()
+        # array forms of the channel tables, used by the batched excitation generator
+        self.one_body_channel_array: np.ndarray = np.array(self.one_body_state_channel_indices, dtype=np.int64)
+        self.two_body_channel_array: np.ndarray = np.array(self.two_body_channel_table, dtype=np.int64)
 
     def get_orbit(self, index: int) -> Orbital:
         return self.sp_orbits[index]
@@ -212,6 +253,35 @@ class Basis:
                 self.two_body_state_channel_indices[connection_pos] = channel_index
                 self.two_body_state_channel_positions[connection_pos] = channel_position
 
+    # one-body channel masks, and two-body channels as blocks of one-body channel pairs
+    def build_channel_masks(self):
+        self.one_body_channel_masks = []
+        for channel in self.one_body_basis_channel:
+            mask = 0
+            for orbit_index in channel:
+                mask |= 1 << orbit_index
+            self.one_body_channel_masks.append(mask)
+        # a two-body channel is the union of blocks (x, y), x <= y, holding all pairs (r, s) with r in channel x and s in channel y
+        chs = self.one_body_state_channel_indices
+        self.two_body_channel_table = [[-1] * self.one_body_channel_number for _ in range(self.one_body_channel_number)]
+        self.two_body_channel_blocks = [[] for _ in range(self.two_body_channel_number)]
+        for channel_index in range(self.two_body_channel_number):
+            block_sizes = defaultdict(int)
+            for r, s in self.two_body_basis_channel[channel_index]:
+                x, y = min(chs[r], chs[s]), max(chs[r], chs[s])
+                if self.two_body_channel_table[x][y] not in (-1, channel_index):
+                    raise ValueError("error in build_channel_masks()...")
+                self.two_body_channel_table[x][y] = channel_index
+                self.two_body_channel_table[y][x] = channel_index
+                block_sizes[(x, y)] += 1
+            for (x, y), size in block_sizes.items():
+                mx = len(self.one_body_basis_channel[x])
+                my = len(self.one_body_basis_channel[y])
+                full_size = mx * (mx - 1) // 2 if x == y else mx * my
+                if size != full_size:
+                    raise ValueError("error in build_channel_masks(): two-body channel is not a product of one-body channels")
+                self.two_body_channel_blocks[channel_index].append((x, y))
+
     def get_two_body_channel_index(self, index_i: int, index_j: int) -> int:
         return self.two_body_state_channel_indices[self.get_two_body_connection_pos(index_i, index_j)]
 
@@ -225,65 +295,78 @@ class Basis:
         D0 = Det(D0_indices, self.NMO)
         return D0
 
-    def find_combination_2(self, n: int, x: int) -> int:
-        for a in range(1, n):
-            combinations_for_a = n - a
-            if x <= combinations_for_a:
-                b = a + x
-                return (a, b)
-            else:
-                x -= combinations_for_a
-
-        raise ValueError("Error in find_combination_2!!!")
-
-    def single_excite(self, Di: Det) -> Tuple[int, int, int]:
-        a = Di.find_nth(random.randint(1, self.particle_number))
-        b = 0
-        invp = 0
-        channel = self.get_one_body_channel(a)
-        for r in channel:
-            if not Di.is_occupied(r):
-                invp += 1
-        if invp == 0:
-            return (0, 0, 0)
-        excite_to = random.randint(1, invp)
-        for r in channel:
-            if not Di.is_occupied(r):
-                if excite_to > 1:
-                    excite_to -= 1
-                    continue
-                else:
-                    b = r
-                    break
-        invp = invp * self.particle_number
+    # bitstrings of all single and double excitations of bits allowed by symmetry
+    def connected_dets(self, bits: int) -> List[int]:
+        dets = []
+        occ = occupied_indices(bits).tolist()
+        for a in occ:
+            free = self.one_body_channel_masks[self.one_body_state_channel_indices[a]] & ~bits
+            for b in occupied_indices(free).tolist():
+                dets.append(bits ^ (1 << a) ^ (1 << b))
+        for a, b in itertools.combinations(occ, 2):
+            for c, d in self.get_two_body_channel(a, b):
+                if not (bits >> c) & 1 and not (bits >> d) & 1:
+                    dets.append(bits ^ (1 << a) ^ (1 << b) ^ (1 << c) ^ (1 << d))
+        return dets
+
+    # unoccupied orbitals of every one-body channel, flattened with offsets
+    def free_orbitals(self, bits: int) -> Tuple[List[np.ndarray], np.ndarray, np.ndarray]:
+        frees = [occupied_indices(mask & ~bits) for mask in self.one_body_channel_masks]
+        sizes = np.array([len(free) for free in frees], dtype=np.int64)
+        return frees, sizes, np.concatenate(frees)
+
+    # count single excitations of bits at once; failed attempts have invp = 0
+    def single_excite_batch(self, bits: int, count: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        occ = occupied_indices(bits)
+        a = occ[rng.integers(0, len(occ), size=count)]
+        b = np.zeros(count, dtype=np.int64)
+        invp = np.zeros(count, dtype=np.int64)
+        frees, sizes, flat = self.free_orbitals(bits)
+        if count == 0 or len(flat) == 0:
+            return (a, b, invp)
+        channels = self.one_body_channel_array[a]
+        m = sizes[channels]
+        k = (rng.random(count) * m).astype(np.int64)
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        valid = m > 0
+        b[valid] = flat[offsets[channels[valid]] + k[valid]]
+        invp[valid] = m[valid] * len(occ)
         return (a, b, invp)
 
-    def double_excite(self, Di: Det) -> Tuple[int, int, int, int, int]:
-        # a, b, c, d, invp = 0, 1, 2, 3, 1  # to delete
-        num = self.particle_number
-        two_body_conditions = int((num * (num - 1)) / 2)
-        temp = random.randint(1, two_body_conditions)
-        a_idx, b_idx = self.find_combination_2(num, temp)
-        a = Di.find_nth(a_idx)
-        b = Di.find_nth(b_idx)
-        c = 0
-        d = 0
-        invp = 0
-        channel = self.get_two_body_channel(a, b)
-        for r, s in channel:
-            if (not Di.is_occupied(r)) and (not Di.is_occupied(s)):
-                invp += 1
-        if invp == 0:
-            return (0, 0, 0, 0, 0)
-        excite_to = random.randint(1, invp)
-        for r, s in channel:
-            if (not Di.is_occupied(r)) and (not Di.is_occupied(s)):
-                if excite_to > 1:
-                    excite_to -= 1
-                    continue
+    # count double excitations of bits at once; failed attempts have invp = 0
+    def double_excite_batch(self, bits: int, count: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        occ = occupied_indices(bits)
+        num = len(occ)
+        two_body_conditions = num * (num - 1) // 2
+        i, j = combination_2_batch(num, rng.integers(0, two_body_conditions, size=count))
+        a = occ[i]
+        b = occ[j]
+        c = np.zeros(count, dtype=np.int64)
+        d = np.zeros(count, dtype=np.int64)
+        invp = np.zeros(count, dtype=np.int64)
+        frees, sizes, flat = self.free_orbitals(bits)
+        channels = self.two_body_channel_array[self.one_body_channel_array[a], self.one_body_channel_array[b]]
+        u = rng.random(count)
+        for channel in np.unique(channels).tolist():
+            selected = np.flatnonzero(channels == channel)
+            blocks = self.two_body_channel_blocks[channel]
+            block_sizes = [sizes[x] * (sizes[x] - 1) // 2 if x == y else sizes[x] * sizes[y] for x, y in blocks]
+            total = int(sum(block_sizes))
+            if total == 0:
+                continue
+            k = (u[selected] * total).astype(np.int64)
+            invp[selected] = total * two_body_conditions
+            start = 0
+            for (x, y), size in zip(blocks, block_sizes):
+                in_block = (k >= start) & (k < start + size)
+                kk = k[in_block] - start
+                if x == y:
+                    r_idx, s_idx = combination_2_batch(int(sizes[x]), kk)
                 else:
-                    c = r
-                    d = s
-                    break
-        invp = invp * two_body_conditions
+                    r_idx, s_idx = np.divmod(kk, sizes[y])
+                r = frees[x][r_idx]
+                s = frees[y][s_idx]
+                c[selected[in_block]] = np.minimum(r, s)
+                d[selected[in_block]] = np.maximum(r, s)
+                start += size
         return (a, b, c, d, invp)
@@ -0,0 +1,146 @@
+from typing import Iterable, List, Union
+
+import numpy as np
+
+WORD_BITS = 64
+ALL_ONES = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+# number of uint64 words needed for nmo orbitals
+def word_number(nmo: int) -> int:
+    return max(1, (nmo + WORD_BITS - 1) // WORD_BITS)
+
+
+# words with the bits [0, x) set, for x in [0, 64]
+def ones_below(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.int64)
+    shift = np.minimum(x, WORD_BITS - 1).astype(np.uint64)
+    return np.where(x >= WORD_BITS, ALL_ONES, (np.uint64(1) << shift) - np.uint64(1))
+
+
+# (len(indices), k) words with the single bit of each orbital index set
+def bit_mask_words(indices: np.ndarray, k: int) -> np.ndarray:
+    indices = np.asarray(indices, dtype=np.int64)
+    words = np.zeros((len(indices), k), dtype=np.uint64)
+    words[np.arange(len(indices)), indices >> 6] = np.uint64(1) << (indices & 63).astype(np.uint64)
+    return words
+
+
+# structured dtype comparing K-word determinants word by word, highest word first
+def key_dtype(k: int) -> np.dtype:
+    return np.dtype({"names": [f"w{w}" for w in reversed(range(k))], "formats": [np.uint64] * k, "offsets": [8 * w for w in reversed(range(k))], "itemsize": 8 * k})
+
+
+# sortable 1-D keys of (n, K) words without copying; one key per determinant
+def det_keys(words: np.ndarray) -> np.ndarray:
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    if words.shape[1] == 1:
+        return words[:, 0]
+    return words.view(key_dtype(words.shape[1])).ravel()
+
+
+def int_to_words(bits: int, k: int) -> np.ndarray:
+    words = np.zeros(k, dtype=np.uint64)
+    for w in range(k):
+        words[w] = (bits >> (WORD_BITS * w)) & 0xFFFFFFFFFFFFFFFF
+    return words
+
+
+def words_to_int(words: np.ndarray) -> int:
+    bits = 0
+    for w, word in enumerate(words.tolist()):
+        bits |= word << (WORD_BITS * w)
+    return bits
+
+
+class DetArray:
+    # fixed-width determinants for any number of orbitals
+    # words: (n, K) uint64 array, word w of a determinant holds orbitals [64w, 64w + 64)
+    def __init__(self, words: np.ndarray, nmo: int):
+        self.nmo: int = nmo
+        self.k: int = word_number(nmo)
+        self.words: np.ndarray = np.asarray(words, dtype=np.uint64).reshape(-1, self.k)
+
+    @classmethod
+    def zeros(cls, n: int, nmo: int) -> "DetArray":
+        return cls(np.zeros((n, word_number(nmo)), dtype=np.uint64), nmo)
+
+    @classmethod
+    def from_ints(cls, ints: Iterable[int], nmo: int) -> "DetArray":
+        ints = list(ints)
+        k = word_number(nmo)
+        if k == 1:
+            return cls(np.array(ints, dtype=np.uint64), nmo)
+        words = np.zeros((len(ints), k), dtype=np.uint64)
+        for i, bits in enumerate(ints):
+            words[i] = int_to_words(bits, k)
+        return cls(words, nmo)
+
+    def to_ints(self) -> List[int]:
+        if self.k == 1:
+            return self.words[:, 0].tolist()
+        return [words_to_int(row) for row in self.words]
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __getitem__(self, index) -> "DetArray":
+        return DetArray(self.words[index], self.nmo)
+
+    def other_words(self, other: Union["DetArray", np.ndarray]) -> np.ndarray:
+        return other.words if isinstance(other, DetArray) else other
+
+    def __xor__(self, other: Union["DetArray", np.ndarray]) -> "DetArray":
+        return DetArray(self.words ^ self.other_words(other), self.nmo)
+
+    def __and__(self, other: Union["DetArray", np.ndarray]) -> "DetArray":
+        return DetArray(self.words & self.other_words(other), self.nmo)
+
+    def __or__(self, other: Union["DetArray", np.ndarray]) -> "DetArray":
+        return DetArray(self.words | self.other_words(other), self.nmo)
+
+    def __invert__(self) -> "DetArray":
+        return DetArray(~self.words, self.nmo)
+
+    def __eq__(self, other: object) -> np.ndarray:
+        if not isinstance(other, DetArray):
+            return NotImplemented
+        return np.all(self.words == other.words, axis=-1)
+
+    # number of occupied orbitals of every determinant
+    def popcount(self) -> np.ndarray:
+        return np.bitwise_count(self.words).sum(axis=-1).astype(np.int64)
+
+    # occupation of orbital indices[i] in determinant i (or in all determinants of a single-row array)
+    def test(self, indices: np.ndarray) -> np.ndarray:
+        indices = np.asarray(indices, dtype=np.int64)
+        rows = np.arange(len(indices)) if len(self.words) > 1 else np.zeros(len(indices), dtype=np.int64)
+        return ((self.words[rows, indices >> 6] >> (indices & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)
+
+    # flip orbital indices[i] in determinant i, a single-row array is broadcast
+    def flip(self, indices: np.ndarray) -> "DetArray":
+        return DetArray(self.words ^ bit_mask_words(indices, self.k), self.nmo)
+
+    # number of occupied orbitals strictly between orbitals i and j, per determinant
+    def count_between(self, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        lo = np.minimum(i, j)[:, None]
+        hi = np.maximum(i, j)[:, None]
+        start = WORD_BITS * np.arange(self.k)[None, :]
+        low = np.clip(lo + 1 - start, 0, WORD_BITS)
+        high = np.clip(hi - start, 0, WORD_BITS)
+        mask = ones_below(high) & ~ones_below(low)
+        return np.bitwise_count(self.words & mask).sum(axis=-1).astype(np.int64)
+
+    # sortable keys, see det_keys
+    def keys(self) -> np.ndarray:
+        return det_keys(self.words)
+
+    # 64-bit hash of every determinant, for fixed-size tables and partitioning
+    def hash(self) -> np.ndarray:
+        h = np.full(len(self.words), 0xCBF29CE484222325, dtype=np.uint64)
+        for w in range(self.k):
+            h = (h ^ self.words[:, w]) * np.uint64(0x100000001B3)
+        # splitmix64 finalizer
+        h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return h ^ (h >> np.uint64(31))
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class MatrixElementCache:
+    # bounded cache of matrix elements keyed on raw integer bitstrings
+    # capacity: maximum number of stored elements
+    # policy: "lru" evicts the least recently used element, "fifo" the oldest inserted one
+    def __init__(self, capacity: int, policy: str = "lru"):
+        if capacity <= 0:
+            raise ValueError(f"error: cache capacity must be positive, got {capacity}")
+        if policy not in ("lru", "fifo"):
+            raise ValueError(f"error: unknown cache policy {policy}")
+        self.capacity: int = capacity
+        self.policy: str = policy
+        self.data: OrderedDict = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    # cached value of key, None on a miss
+    def get(self, key: Hashable) -> Any:
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.policy == "lru":
+            self.data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self.data[key] = value
+        if len(self.data) > self.capacity:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def print_info(self):
+        print(f"cache: size = {len(self.data)}/{self.capacity}, policy = {self.policy}, hits = {self.hits}, misses = {self.misses}, evictions = {self.evictions}, hit rate = {100.0 * self.hit_rate():.2f}%")
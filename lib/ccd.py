@@ -1,14 +1,71 @@
 import numpy as np
 
 from .basis import *
+from .pairspace import *
+
+
+class DIIS:
+    """
+    Direct inversion in the iterative subspace (Pulay) for a fixed-point iteration t -> t_new
+
+    param max_vectors: size of the subspace, the oldest vector is dropped when it is full
+    """
+
+    def __init__(self, max_vectors: int = 8):
+        self.max_vectors = max_vectors
+        self.vectors = []
+        self.residuals = []
+
+    def clear(self):
+        self.vectors = []
+        self.residuals = []
+
+    def extrapolate(self, vector, residual):
+        """
+        Adds an iterate and returns the combination of the stored iterates with the smallest residual
+
+        param vector: new iterate t_new
+        param residual: t_new - t
+
+        return: extrapolated iterate; the subspace restarts from the new iterate when the residuals are linearly
+                dependent or the new residual is far larger than the best stored one (the iteration jumped away)
+        """
+        norms = [np.linalg.norm(r) for r in self.residuals]
+        if norms and np.linalg.norm(residual) > 1e3 * min(norms):
+            self.clear()
+        self.vectors.append(vector)
+        self.residuals.append(residual)
+        if len(self.vectors) > self.max_vectors:
+            self.vectors.pop(0)
+            self.residuals.pop(0)
+        n = len(self.vectors)
+        if n < 2:
+            return vector
+        flat = np.array([r.ravel() for r in self.residuals])
+        overlap = flat @ flat.T
+        B = -np.ones((n + 1, n + 1))
+        B[:n, :n] = overlap / np.max(np.diag(overlap))
+        B[n, n] = 0.0
+        rhs = np.zeros(n + 1)
+        rhs[n] = -1.0
+        if np.linalg.cond(B) > 1e14:
+            self.clear()
+            self.vectors.append(vector)
+            self.residuals.append(residual)
+            return vector
+        c = np.linalg.solve(B, rhs)[:n]
+        return sum(ci * v for ci, v in zip(c, self.vectors))
 
 
 class CCD:
 
-    def __init__(self, basis: Basis):
+    # diis_size: DIIS subspace of get_ccd, 0 for the plain linear mixing
+    def __init__(self, basis: Basis, diis_size: int = 8):
         self.pnum = basis.NMO - basis.particle_number
         self.hnum = basis.particle_number
         self.delta = basis.delta
+        self.diis_size = diis_size
+        self.t2 = None  # converged amplitudes of the last get_ccd
 
     def init_pairing_v(self, g, pnum, hnum):
         """
@@ -78,29 +135,37 @@ class CCD:
 
         return f_pp, f_hh
 
-    def init_t2(self, v_pphh, f_pp, f_hh):
+    def init_denominator(self, f_pp, f_hh):
+        """
+        Energy denominators of the amplitude equations
+
+        param f_pp:   Fock matrix in pp channel
+        param f_hh:   Fock matrix in hh channel
+
+        return denominator: numpy array in pphh format, f_ii + f_jj - f_aa - f_bb
+        """
+        e_p = np.diag(f_pp)
+        e_h = np.diag(f_hh)
+        return e_h[None, None, :, None] + e_h[None, None, None, :] - e_p[:, None, None, None] - e_p[None, :, None, None]
+
+    def init_t2(self, v_pphh, f_pp, f_hh, denominator=None):
         """
         Initializes t2 amlitudes as in MBPT2, see first equation on page 345
 
         param v_pphh: pairing tensor in pphh channel
         param f_pp:   Fock matrix in pp channel
         param f_hh:   Fock matrix in hh channel
+        param denominator: energy denominators from init_denominator, computed when None
 
         return t2: numpy array in pphh format, 4-indices tensor
         """
-        pnum = len(f_pp)
-        hnum = len(f_hh)
-        t2_new = np.zeros((pnum, pnum, hnum, hnum))
-        for i in range(hnum):
-            for j in range(hnum):
-                for a in range(pnum):
-                    for b in range(pnum):
-                        t2_new[a, b, i, j] = v_pphh[a, b, i, j] / (f_hh[i, i] + f_hh[j, j] - f_pp[a, a] - f_pp[b, b])
-        return t2_new
+        if denominator is None:
+            denominator = self.init_denominator(f_pp, f_hh)
+        return v_pphh / denominator
 
     # CCD equations. Note that the "->abij" assignment is redundant, because indices are ordered alphabetically.
     # Nevertheless, we retain it for transparency.
-    def ccd_iter(self, v_pppp, v_pphh, v_hhhh, f_pp, f_hh, t2):
+    def ccd_iter(self, v_pppp, v_pphh, v_hhhh, f_pp, f_hh, t2, denominator=None):
         """
         Performs one iteration of the CCD equations (8.34), using also intermediates for the nonliniar terms
 
@@ -110,11 +175,10 @@ class CCD:
         param f_pp: Fock matrix in pp channel
         param f_hh: Fock matrix in hh channel
         param t2: Initial t2 amplitude, tensor in form of pphh channel
+        param denominator: energy denominators from init_denominator, computed when None
 
         return t2_new: new t2 amplitude, tensor in form of pphh channel
         """
-        pnum = len(f_pp)
-        hnum = len(f_hh)
         Hbar_pphh = v_pphh + np.einsum("bc,acij->abij", f_pp, t2) - np.einsum("ac,bcij->abij", f_pp, t2) - np.einsum("abik,kj->abij", t2, f_hh) + np.einsum("abjk,ki->abij", t2, f_hh) + 0.5 * np.einsum("abcd,cdij->abij", v_pppp, t2) + 0.5 * np.einsum("abkl,klij->abij", t2, v_hhhh)
 
         # hh intermediate, see (8.47)
@@ -137,14 +201,9 @@ class CCD:
 
         Hbar_pphh = Hbar_pphh + (np.einsum("bkcj,acik->abij", chi_phph, t2) - np.einsum("bkcj,acik->baij", chi_phph, t2) - np.einsum("bkcj,acik->abji", chi_phph, t2) + np.einsum("bkcj,acik->baji", chi_phph, t2))
 
-        t2_new = np.zeros((pnum, pnum, hnum, hnum))
-        for i in range(hnum):
-            for j in range(hnum):
-                for a in range(pnum):
-                    for b in range(pnum):
-                        t2_new[a, b, i, j] = t2[a, b, i, j] + Hbar_pphh[a, b, i, j] / (f_hh[i, i] + f_hh[j, j] - f_pp[a, a] - f_pp[b, b])
-
-        return t2_new
+        if denominator is None:
+            denominator = self.init_denominator(f_pp, f_hh)
+        return t2 + Hbar_pphh / denominator
 
     def ccd_energy(self, v_pphh, t2):
         """
@@ -159,7 +218,8 @@ class CCD:
         erg = 0.25 * np.einsum("abij,abij", v_pphh, t2)
         return erg
 
-    def get_ccd(self, g: float):
+    # t2: starting amplitudes, e.g. converged at a neighbouring g; MBPT2 amplitudes when None
+    def get_ccd(self, g: float, t2: np.ndarray = None):
         pnum = self.pnum
         hnum = self.hnum
         delta = self.delta
@@ -169,24 +229,129 @@ class CCD:
         f_pp, f_hh = self.init_pairing_fock(delta, g, pnum, hnum)
 
         # Initialize T2 amplitudes from MBPT2
-        t2 = self.init_t2(v_pphh, f_pp, f_hh)
-        erg = self.ccd_energy(v_pphh, t2)
+        denominator = self.init_denominator(f_pp, f_hh)
+        if t2 is None:
+            t2 = self.init_t2(v_pphh, f_pp, f_hh, denominator)
+
+        return self.solve(lambda t: self.ccd_iter(v_pppp, v_pphh, v_hhhh, f_pp, f_hh, t, denominator), lambda t: self.ccd_energy(v_pphh, t), t2)
 
+    def solve(self, update, energy, t2):
+        """
+        Iterates the amplitude equations to self-consistency, with DIIS (or linear mixing when diis_size is 0)
+
+        param update: one Jacobi step, t2 -> t2_new
+        param energy: correlation energy of amplitudes t2
+        param t2: starting amplitudes
+
+        return: converged correlation energy, None when the iteration diverges; the amplitudes are kept in self.t2
+        """
+        erg = energy(t2)
+        diis = DIIS(self.diis_size) if self.diis_size > 0 else None
         eps = 10.0
         erg_old = erg
         erg_new = erg
         iter = 0
         iter_max = 1000
         while eps > 1e-9:
-            t2_new = self.ccd_iter(v_pppp, v_pphh, v_hhhh, f_pp, f_hh, t2)
-            erg_new = self.ccd_energy(v_pphh, t2_new)
+            t2_new = update(t2)
+            erg_new = energy(t2_new)
             print(f"iter = {iter}, erg = {erg_new:.9f}, eps = {eps:.9f}")
-            mix = 0.5
-            t2 = mix * t2_new + (1 - mix) * t2
+            if not np.isfinite(erg_new) or not np.all(np.isfinite(t2_new)):
+                print("CCD did not converge")
+                return None
+            if diis is None:
+                mix = 0.5
+                t2 = mix * t2_new + (1 - mix) * t2
+            else:
+                t2 = diis.extrapolate(t2_new, t2_new - t2)
             eps = abs(erg_old - erg_new)
             erg_old = erg_new
             iter += 1
             if iter > iter_max:
                 print("CCD did not converge")
                 return None
+        self.t2 = t2
         return float(erg_new)
+
+
+class PairCCD(CCD):
+    """
+    CCD of the pairing model in pair space
+
+    The pairing interaction only moves pairs, and the CCD amplitudes keep the pair form of the MBPT2 start: t2 is
+    zero unless (a, b) and (i, j) are both time-reversed pairs, so the pair amplitudes t[A, I] = t2[2A, 2A+1, 2I, 2I+1]
+    carry everything. Every diagram of CCD.ccd_iter reduces to row and column sums of t, so one iteration costs
+    O(P H) time and memory for P particle and H hole pair levels, and the iterates are those of CCD.get_ccd.
+
+    basis: Basis of the pairing model, or a PairBasis for large p_max (no two-body basis is built then)
+    """
+
+    def __init__(self, basis, diis_size: int = 8):
+        if isinstance(basis, PairBasis):
+            self.H = basis.particle_number
+            self.P = basis.NMO - basis.particle_number
+        else:
+            self.H = basis.particle_number // 2
+            self.P = (basis.NMO - basis.particle_number) // 2
+        self.pnum = 2 * self.P
+        self.hnum = 2 * self.H
+        self.delta = basis.delta
+        self.diis_size = diis_size
+        self.t2 = None  # converged pair amplitudes t[A, I] of the last get_ccd
+
+    def init_pair_fock(self, delta, g, P, H):
+        """
+        Pair-level energies of the Fock matrix of init_pairing_fock
+
+        return e_p, e_h: np.array(P), np.array(H), the diagonal Fock elements of either orbital of each pair level
+        """
+        e_p = delta * (H + np.arange(P))
+        e_h = delta * np.arange(H) - 0.5 * g
+        return e_p, e_h
+
+    def init_pair_denominator(self, e_p, e_h):
+        """
+        return denominator: np.array(P, H), 2 e_I - 2 e_A, the pair element of init_denominator
+        """
+        return 2.0 * e_h[None, :] - 2.0 * e_p[:, None]
+
+    def pair_iter(self, g, e_p, e_h, t, denominator):
+        """
+        One iteration of ccd_iter on the pair amplitudes
+
+        param t: pair amplitudes, np.array(P, H)
+
+        return t_new: pair amplitudes after one Jacobi step
+        """
+        G = -0.5 * g
+        rows = t.sum(axis=1)[:, None]  # sum_J t[A, J]
+        columns = t.sum(axis=0)[None, :]  # sum_B t[B, I]
+        # v_pphh, Fock, v_pppp and v_hhhh ladders, chi_hh and chi_pp, chi_hhhh and chi_phph terms in this order
+        Hbar = G + 2.0 * (e_p[:, None] - e_h[None, :]) * t + G * (columns + rows) - 2.0 * G * t * (columns + rows) + G * columns * rows + 2.0 * G * t * t
+        return t + Hbar / denominator
+
+    def pair_energy(self, g, t):
+        """
+        return energy: CCD correlation energy of the pair amplitudes, ccd_energy of the corresponding t2
+        """
+        return -0.5 * g * t.sum()
+
+    # t2: starting pair amplitudes t[A, I], e.g. converged at a neighbouring g; MBPT2 amplitudes when None
+    def get_ccd(self, g: float, t2: np.ndarray = None):
+        e_p, e_h = self.init_pair_fock(self.delta, g, self.P, self.H)
+        denominator = self.init_pair_denominator(e_p, e_h)
+        if t2 is None:
+            t2 = -0.5 * g / denominator
+        return self.solve(lambda t: self.pair_iter(g, e_p, e_h, t, denominator), lambda t: self.pair_energy(g, t), t2)
+
+    def get_t2(self):
+        """
+        return t2: the amplitudes of the last get_ccd as the full pphh tensor of CCD, for small bases only
+        """
+        t2 = np.zeros((self.pnum, self.pnum, self.hnum, self.hnum))
+        for A in range(self.P):
+            for I in range(self.H):
+                for (a, b), sign_ab in (((2 * A, 2 * A + 1), 1.0), ((2 * A + 1, 2 * A), -1.0)):
+                    for (i, j), sign_ij in (((2 * I, 2 * I + 1), 1.0), ((2 * I + 1, 2 * I), -1.0)):
+                        t2[a, b, i, j] = sign_ab * sign_ij * self.t2[A, I]
+        return t2
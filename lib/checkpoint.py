@@ -0,0 +1,157 @@
+import os
+import json
+import random
+import zlib
+import struct
+import threading
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .bitstring import *
+from .trace import *
+
+# file layout: MAGIC, header length (uint64), JSON header, then the zlib-compressed sections in SECTIONS order
+MAGIC = b"PFCQMC01"
+SECTIONS = ("dets", "pops", "diags", "refs", "core", "traces")
+
+
+# byte shuffle: group byte j of every 8-byte value together, so small deltas leave long runs of zeros for zlib
+def shuffle_bytes(values: np.ndarray) -> bytes:
+    return np.ascontiguousarray(values).view(np.uint8).reshape(-1, 8).T.tobytes()
+
+
+def unshuffle_bytes(data: bytes, dtype: np.dtype) -> np.ndarray:
+    return np.ascontiguousarray(np.frombuffer(data, dtype=np.uint8).reshape(8, -1).T).view(dtype).ravel()
+
+
+# determinants sorted by det_keys (highest word first): the highest word is stored as differences to the previous
+# determinant, the lower words as xor with the previous determinant
+def encode_dets(words: np.ndarray) -> bytes:
+    encoded = words.copy()
+    encoded[1:, -1] = words[1:, -1] - words[:-1, -1]
+    encoded[1:, :-1] = words[1:, :-1] ^ words[:-1, :-1]
+    return shuffle_bytes(encoded)
+
+
+def decode_dets(data: bytes, k: int) -> np.ndarray:
+    words = unshuffle_bytes(data, np.uint64).reshape(-1, k)
+    words[:, -1] = np.cumsum(words[:, -1], dtype=np.uint64)
+    words[:, :-1] = np.bitwise_xor.accumulate(words[:, :-1], axis=0)
+    return words
+
+
+# copy of everything a restart needs, taken between two steps; the arrays are copies, so the run can go on
+# while the snapshot is written
+def take_snapshot(engine) -> Dict[str, Any]:
+    walkers = engine.walkers
+    header = {
+        "nmo": engine.NMO,
+        "k": walkers.k,
+        "size": walkers.size,
+        "S": engine.S,
+        "d_tau": engine.d_tau,
+        "energy_numerator": engine.energy_numerator,
+        "total_number": engine.total_number,
+        "step_count": engine.step_count,
+        "shift_number": engine.shift_number,
+        "tau_offset": engine.tau_offset,
+        "tau_step": engine.tau_step,
+        "time_step": engine.time_step.get_state(),
+        "max_diagonal": engine.max_diagonal,
+        "trace_length": len(engine.trace),
+        "trace_columns": [name for name, _ in TRACE_SCHEMA],
+        "numpy_rng": engine.rng.bit_generator.state,
+        "python_random": random.getstate(),
+        "reblock": engine.reblock.get_state(),
+    }
+    # a file-backed trace is flushed and only its length is saved, an in-memory one is saved whole
+    engine.trace.flush()
+    if engine.trace.path is None:
+        traces = np.concatenate([engine.trace.column(name).astype(float) for name, _ in TRACE_SCHEMA])
+    else:
+        traces = np.zeros(0)
+    arrays = {
+        "dets": walkers.get_dets().copy(),
+        "pops": walkers.get_pops().copy(),
+        "diags": walkers.get_diags().copy(),
+        "refs": walkers.get_refs().copy(),
+        "core": walkers.get_core().copy(),
+        "traces": traces,
+    }
+    return {"header": header, "arrays": arrays}
+
+
+def encode_section(name: str, array: np.ndarray) -> bytes:
+    if name == "dets":
+        raw = encode_dets(array)
+    elif name == "core":
+        raw = np.packbits(array).tobytes()
+    else:
+        raw = shuffle_bytes(array.astype(float))
+    return zlib.compress(raw, 6)
+
+
+def decode_section(name: str, data: bytes, header: Dict[str, Any]) -> np.ndarray:
+    raw = zlib.decompress(data)
+    if name == "dets":
+        return decode_dets(raw, header["k"]) if header["size"] > 0 else np.zeros((0, header["k"]), dtype=np.uint64)
+    if name == "core":
+        return np.unpackbits(np.frombuffer(raw, dtype=np.uint8), count=header["size"]).astype(bool)
+    return unshuffle_bytes(raw, np.float64) if len(raw) > 0 else np.zeros(0)
+
+
+# write a snapshot to path atomically: a crash leaves either the old or the new checkpoint, never a partial one
+def write_checkpoint(path: str, snapshot: Dict[str, Any]):
+    header = dict(snapshot["header"])
+    sections = [encode_section(name, snapshot["arrays"][name]) for name in SECTIONS]
+    header["section_sizes"] = [len(section) for section in sections]
+    header_bytes = json.dumps(header).encode()
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<Q", len(header_bytes)))
+        file.write(header_bytes)
+        for section in sections:
+            file.write(section)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def read_checkpoint(path: str) -> Dict[str, Any]:
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"error: {path} is not a FCIQMC checkpoint")
+        header_size = struct.unpack("<Q", file.read(8))[0]
+        header = json.loads(file.read(header_size))
+        arrays = {name: decode_section(name, file.read(size), header) for name, size in zip(SECTIONS, header["section_sizes"])}
+    return {"header": header, "arrays": arrays}
+
+
+# writes snapshots on a background thread, at most one write in flight
+class CheckpointWriter:
+    def __init__(self):
+        self.thread: Optional[threading.Thread] = None
+        self.error: Optional[BaseException] = None
+
+    def write(self, path: str, snapshot: Dict[str, Any]):
+        try:
+            write_checkpoint(path, snapshot)
+        except BaseException as error:
+            self.error = error
+
+    # start writing snapshot to path, after the previous write has finished
+    def submit(self, path: str, snapshot: Dict[str, Any]):
+        self.wait()
+        self.thread = threading.Thread(target=self.write, args=(path, snapshot), daemon=True)
+        self.thread.start()
+
+    # block until the pending write is on disk; a failed write is raised here
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
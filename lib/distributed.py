@@ -0,0 +1,228 @@
+import os
+import sys
+import queue
+import socket
+import struct
+import threading
+import time
+import multiprocessing as mp
+
+from .parallel import *
+
+# message header: kind, payload length in bytes
+HEADER = struct.Struct("<BQ")
+SPAWNS, END_OF_STEP, ESTIMATORS = 1, 2, 3
+ESTIMATOR_FORMAT = struct.Struct("<4d")
+
+
+# little-endian spawn record on the wire: target words, amplitude, target diagonal energy, initiator flag
+def wire_dtype(k: int) -> np.dtype:
+    return np.dtype([("det", "<u8", (k,)), ("amp", "<f8"), ("diag", "<f8"), ("initiator", "u1")])
+
+
+def receive_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError("error: peer closed the connection")
+        received += count
+    return bytes(data)
+
+
+# FCIQMC rank of a job spread over several hosts
+# addresses: (host, port) of every rank; ranks are fully connected by TCP, rank r listens on addresses[r]
+# and connects to all lower ranks; one sender and one receiver thread per peer move the messages, so
+# spawns are streamed to their owners in chunks of chunk_records while this rank is still spawning
+class DistributedFCIQMC(PartitionedFCIQMC):
+    def __init__(self, basis: Basis, hamil: Hamiltonian, params: dict, n: int, rank: int, addresses: List[Tuple[str, int]], chunk_records: int = 4096, timeout: float = 60.0):
+        super().__init__(basis, hamil, params, n, len(addresses), rank)
+        # rank 0 keeps the trace, the other ranks sample the same values and only hold them in memory
+        if rank != 0:
+            self.trace = TraceSink()
+        self.addresses: List[Tuple[str, int]] = addresses
+        self.chunk_records: int = chunk_records
+        self.timeout: float = timeout
+        self.wire_dtype: np.dtype = wire_dtype(word_number(self.NMO))
+        self.peers: List[int] = [peer for peer in range(self.processes) if peer != rank]
+        self.sockets: Dict[int, socket.socket] = {}
+        # per peer: outgoing spawns not yet sent, messages to send, messages received
+        self.outgoing: Dict[int, SpawnBuffer] = {peer: SpawnBuffer(self.NMO) for peer in self.peers}
+        self.send_queues: Dict[int, queue.Queue] = {peer: queue.Queue() for peer in self.peers}
+        self.receive_queues: Dict[int, queue.Queue] = {peer: queue.Queue() for peer in self.peers}
+        self.senders: List[threading.Thread] = []
+        self.receivers: List[threading.Thread] = []
+        self.connect()
+
+    # open the full mesh of connections and start the sender and receiver threads
+    def connect(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(self.addresses[self.rank])
+        listener.listen(len(self.peers))
+        for peer in range(self.rank):
+            deadline = time.time() + self.timeout
+            while True:
+                try:
+                    sock = socket.create_connection(self.addresses[peer], timeout=self.timeout)
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.05)
+            sock.sendall(struct.pack("<i", self.rank))
+            self.sockets[peer] = sock
+        listener.settimeout(self.timeout)
+        for _ in range(self.rank + 1, self.processes):
+            sock, _ = listener.accept()
+            peer = struct.unpack("<i", receive_exactly(sock, 4))[0]
+            self.sockets[peer] = sock
+        listener.close()
+        for peer, sock in self.sockets.items():
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.senders.append(threading.Thread(target=self.send_loop, args=(peer,), daemon=True))
+            self.receivers.append(threading.Thread(target=self.receive_loop, args=(peer,), daemon=True))
+        for thread in self.senders + self.receivers:
+            thread.start()
+
+    def send_loop(self, peer: int):
+        sock = self.sockets[peer]
+        while True:
+            message = self.send_queues[peer].get()
+            if message is None:
+                break
+            sock.sendall(message)
+
+    def receive_loop(self, peer: int):
+        sock = self.sockets[peer]
+        try:
+            while True:
+                kind, size = HEADER.unpack(receive_exactly(sock, HEADER.size))
+                self.receive_queues[peer].put((kind, receive_exactly(sock, size)))
+        except (ConnectionError, OSError) as error:
+            self.receive_queues[peer].put((None, error))
+
+    def send(self, peer: int, kind: int, payload: bytes = b""):
+        self.send_queues[peer].put(HEADER.pack(kind, len(payload)) + payload)
+
+    # next message of a peer, in the order it was sent
+    def receive(self, peer: int) -> Tuple[int, bytes]:
+        kind, payload = self.receive_queues[peer].get()
+        if kind is None:
+            raise payload
+        return (kind, payload)
+
+    def encode(self, buffer: SpawnBuffer) -> bytes:
+        words, amps, initiators, diags = buffer.get_columns()
+        records = np.empty(len(buffer), dtype=self.wire_dtype)
+        records["det"] = words
+        records["amp"] = amps
+        records["diag"] = diags
+        records["initiator"] = initiators
+        return records.tobytes()
+
+    def flush(self, peer: int):
+        if len(self.outgoing[peer]) > 0:
+            self.send(peer, SPAWNS, self.encode(self.outgoing[peer]))
+            self.outgoing[peer].clear()
+
+    # spawn as FCIQMC.spawn, keep the spawns owned by this rank and queue the others for their owners
+    def spawn(self, bits: int, Ni: int, is_initiator: bool, Hii: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        targets, spawn_nums, initiators, diags = super().spawn(bits, Ni, is_initiator, Hii)
+        owners = self.owner(targets)
+        for peer in np.unique(owners).tolist():
+            if peer == self.rank:
+                continue
+            chosen = owners == peer
+            self.outgoing[peer].append(targets[chosen], spawn_nums[chosen], initiators[chosen], diags[chosen])
+            if len(self.outgoing[peer]) >= self.chunk_records:
+                self.flush(peer)
+        mine = owners == self.rank
+        return (targets[mine], spawn_nums[mine], initiators[mine], diags[mine])
+
+    # remote spawns left the rank during spawning; send the rest and collect the chunks of all peers
+    def exchange(self):
+        for peer in self.peers:
+            self.flush(peer)
+            self.send(peer, END_OF_STEP)
+        for peer in self.peers:
+            while True:
+                kind, payload = self.receive(peer)
+                if kind == END_OF_STEP:
+                    break
+                if kind != SPAWNS:
+                    raise ValueError(f"error: unexpected message {kind} from rank {peer} during exchange")
+                records = np.frombuffer(payload, dtype=self.wire_dtype)
+                self.new_walkers.append(records["det"], records["amp"], records["initiator"].astype(bool), records["diag"])
+
+    def allreduce_estimators(self) -> Tuple[float, float, float, float]:
+        local = self.local_estimators()
+        for peer in self.peers:
+            self.send(peer, ESTIMATORS, ESTIMATOR_FORMAT.pack(*local))
+        rows = []
+        for peer in range(self.processes):
+            if peer == self.rank:
+                rows.append(local)
+                continue
+            kind, payload = self.receive(peer)
+            if kind != ESTIMATORS:
+                raise ValueError(f"error: unexpected message {kind} from rank {peer} during all-reduce")
+            rows.append(ESTIMATOR_FORMAT.unpack(payload))
+        return tuple(float(x) for x in np.sum(rows, axis=0))
+
+    # send what is queued, then drop the connections
+    def close(self):
+        for peer in self.peers:
+            self.send_queues[peer].put(None)
+        for thread in self.senders:
+            thread.join()
+        for sock in self.sockets.values():
+            sock.close()
+        self.sockets = {}
+        self.senders = []
+        self.receivers = []
+
+
+# every rank puts (rank, trace columns) or (rank, error) on results, failures to bind or connect included
+def run_local_rank(basis: Basis, hamil: Hamiltonian, params: dict, n: int, rank: int, addresses: List[Tuple[str, int]], results, timeout: float = 60.0):
+    if rank != 0:
+        sys.stdout = open(os.devnull, "w")
+    engine = None
+    try:
+        engine = DistributedFCIQMC(basis, hamil, params, n, rank, addresses, timeout=timeout)
+        engine.warm()
+        engine.start()
+        results.put((rank, {name: np.array(column) for name, column in engine.trace.columns().items()}))
+    except BaseException as error:
+        results.put((rank, error))
+    finally:
+        if engine is not None:
+            engine.close()
+
+
+# test harness: run a distributed job with all ranks on localhost, ports port, port + 1, ...
+# return the trace columns of rank 0, see TRACE_SCHEMA
+# timeout: seconds a rank waits for its peers to connect
+def run_localhost(basis: Basis, hamil: Hamiltonian, params: dict, n: int, ranks: int, port: int = 52000, timeout: float = 60.0) -> Dict[str, np.ndarray]:
+    addresses = [("127.0.0.1", port + rank) for rank in range(ranks)]
+    context = mp.get_context("fork")
+    results = context.Queue()
+    processes = [context.Process(target=run_local_rank, args=(basis, hamil, params, n, rank, addresses, results, timeout)) for rank in range(ranks)]
+    for process in processes:
+        process.start()
+    try:
+        outcome = dict(gather_results(processes, results))
+    finally:
+        for process in processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
+    errors = [outcome[rank] for rank in range(ranks) if isinstance(outcome[rank], BaseException)]
+    if errors:
+        # the other ranks only saw the failed rank drop its connections or never connect
+        raise next((error for error in errors if not isinstance(error, (ConnectionError, TimeoutError))), errors[0])
+    return outcome[0]
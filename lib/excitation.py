@@ -0,0 +1,203 @@
+from .basis import *
+from .hamiltonian import *
+
+
+# Walker/Vose alias table for sampling index i with probability weights[i] / sum(weights)
+# return acceptance probabilities and alias indices, both of len(weights)
+def build_alias_table(weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    n = len(weights)
+    scaled = np.asarray(weights, dtype=float) * n / np.sum(weights)
+    prob = np.ones(n)
+    alias = np.arange(n, dtype=np.int64)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        i = small.pop()
+        j = large.pop()
+        prob[i] = scaled[i]
+        alias[i] = j
+        scaled[j] -= 1.0 - scaled[i]
+        if scaled[j] < 1.0:
+            small.append(j)
+        else:
+            large.append(j)
+    # leftovers are 1 up to rounding
+    return (prob, alias)
+
+
+class SymmetricExcitation:
+    # excitation generator built from the nonzero blocks of hamil.ch_v2mat
+    # only moves with a nonzero matrix element are proposed:
+    # double excitations (a, b) -> (c, d) with v_{cdab} != 0,
+    # single excitations a -> b with v_{bkak} != 0 for some k
+    def __init__(self, basis: Basis, hamil: Hamiltonian):
+        self.basis: Basis = basis
+        self.hamiltonian: Hamiltonian = hamil
+        self.NMO: int = basis.NMO
+        self.k: int = word_number(self.NMO)
+        # double-excitation connectivity, targets grouped by source pair
+        self.source_a: np.ndarray = np.array([], dtype=np.int64)
+        self.source_b: np.ndarray = np.array([], dtype=np.int64)
+        self.source_masks: np.ndarray = np.zeros((0, self.k), dtype=np.uint64)
+        self.target_source: np.ndarray = np.array([], dtype=np.int64)
+        self.target_c: np.ndarray = np.array([], dtype=np.int64)
+        self.target_d: np.ndarray = np.array([], dtype=np.int64)
+        self.target_masks: np.ndarray = np.zeros((0, self.k), dtype=np.uint64)
+        self.build_double_connections()
+        # single-excitation connectivity, targets grouped by source orbital
+        self.single_target_source: np.ndarray = np.array([], dtype=np.int64)
+        self.single_target_b: np.ndarray = np.array([], dtype=np.int64)
+        self.build_single_connections()
+        self.onebody_probability: float = 0.5 if len(self.single_target_b) > 0 else 0.0
+
+    def build_double_connections(self):
+        source_a, source_b, target_source, target_c, target_d = [], [], [], [], []
+        for channel_index in range(self.basis.two_body_channel_number):
+            channel = self.basis.two_body_basis_channel[channel_index]
+            v2mat = self.hamiltonian.ch_v2mat[channel_index]
+            for pos_right, (a, b) in enumerate(channel):
+                targets = [pos_left for pos_left in np.flatnonzero(v2mat[:, pos_right]).tolist() if pos_left != pos_right]
+                if len(targets) == 0:
+                    continue
+                for pos_left in targets:
+                    c, d = channel[pos_left]
+                    target_source.append(len(source_a))
+                    target_c.append(c)
+                    target_d.append(d)
+                source_a.append(a)
+                source_b.append(b)
+        self.source_a = np.array(source_a, dtype=np.int64)
+        self.source_b = np.array(source_b, dtype=np.int64)
+        self.source_masks = bit_mask_words(self.source_a, self.k) | bit_mask_words(self.source_b, self.k)
+        self.target_source = np.array(target_source, dtype=np.int64)
+        self.target_c = np.array(target_c, dtype=np.int64)
+        self.target_d = np.array(target_d, dtype=np.int64)
+        self.target_masks = bit_mask_words(self.target_c, self.k) | bit_mask_words(self.target_d, self.k)
+
+    def build_single_connections(self):
+        target_source, target_b = [], []
+        for channel in self.basis.one_body_basis_channel:
+            for a in channel:
+                for b in channel:
+                    if a == b:
+                        continue
+                    # v_{bkak} is stored as v_{(b,k),(a,k)} with ordered pairs, the ordering signs do not matter here
+                    if any(self.hamiltonian.find_v2mat(min(b, k), max(b, k), min(a, k), max(a, k)) != 0.0 for k in range(self.NMO) if k != a and k != b):
+                        target_source.append(a)
+                        target_b.append(b)
+        self.single_target_source = np.array(target_source, dtype=np.int64)
+        self.single_target_b = np.array(target_b, dtype=np.int64)
+
+    # pick, for every chosen source, one of its connected targets that is unoccupied in bits
+    # free: flags of usable targets, grouped by source; return target positions and inverse probabilities
+    def pick_targets(self, target_source: np.ndarray, free: np.ndarray, sources: np.ndarray, source_number: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+        free_positions = np.flatnonzero(free)
+        counts = np.bincount(target_source[free_positions], minlength=source_number)
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        m = counts[sources]
+        k = (rng.random(len(sources)) * m).astype(np.int64)
+        valid = m > 0
+        positions = np.zeros(len(sources), dtype=np.int64)
+        positions[valid] = free_positions[offsets[sources[valid]] + k[valid]]
+        return (positions, m)
+
+    # count single excitations of bits at once; failed attempts have invp = 0
+    def single_excite_batch(self, bits: int, count: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        a = np.zeros(count, dtype=np.int64)
+        b = np.zeros(count, dtype=np.int64)
+        invp = np.zeros(count, dtype=np.int64)
+        occ = occupied_indices(bits)
+        occupied = np.zeros(self.NMO, dtype=bool)
+        occupied[occ] = True
+        free = occupied[self.single_target_source] & ~occupied[self.single_target_b]
+        sources = occ[np.isin(occ, self.single_target_source[free])]
+        if count == 0 or len(sources) == 0:
+            return (a, b, invp)
+        a = sources[rng.integers(0, len(sources), size=count)]
+        positions, m = self.pick_targets(self.single_target_source, free, a, self.NMO, rng)
+        valid = m > 0
+        b[valid] = self.single_target_b[positions[valid]]
+        invp[valid] = len(sources) * m[valid]
+        return (a, b, invp)
+
+    # count double excitations of bits at once; failed attempts have invp = 0
+    def double_excite_batch(self, bits: int, count: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        a = np.zeros(count, dtype=np.int64)
+        b = np.zeros(count, dtype=np.int64)
+        c = np.zeros(count, dtype=np.int64)
+        d = np.zeros(count, dtype=np.int64)
+        invp = np.zeros(count, dtype=np.int64)
+        D = int_to_words(bits, self.k)
+        source_occupied = np.all((self.source_masks & D) == self.source_masks, axis=1)
+        free = source_occupied[self.target_source] & np.all((self.target_masks & D) == 0, axis=1)
+        # sources without any free target would only produce failed attempts
+        usable = np.zeros(len(self.source_masks), dtype=bool)
+        usable[self.target_source[free]] = True
+        sources = np.flatnonzero(usable)
+        if count == 0 or len(sources) == 0:
+            return (a, b, c, d, invp)
+        chosen = sources[rng.integers(0, len(sources), size=count)]
+        positions, m = self.pick_targets(self.target_source, free, chosen, len(self.source_masks), rng)
+        a = self.source_a[chosen]
+        b = self.source_b[chosen]
+        c = self.target_c[positions]
+        d = self.target_d[positions]
+        invp = len(sources) * m
+        return (a, b, c, d, invp)
+
+
+class HeatBathExcitation(SymmetricExcitation):
+    # heat-bath excitation generator: double excitations (a, b) -> (c, d) are drawn with probability |v_{cdab}| / sum_{cd} |v_{cdab}|
+    # from alias tables precomputed per source pair; draws that land on an occupied target fail
+    # single excitations are sampled as in SymmetricExcitation
+    def __init__(self, basis: Basis, hamil: Hamiltonian):
+        super().__init__(basis, hamil)
+        self.target_weights: np.ndarray = np.zeros(len(self.target_c))
+        self.source_weights: np.ndarray = np.zeros(len(self.source_a))
+        self.source_offsets: np.ndarray = np.zeros(len(self.source_a), dtype=np.int64)
+        self.source_sizes: np.ndarray = np.zeros(len(self.source_a), dtype=np.int64)
+        self.alias_prob: np.ndarray = np.ones(len(self.target_c))
+        self.alias_index: np.ndarray = np.arange(len(self.target_c), dtype=np.int64)
+        self.build_alias_tables()
+
+    def build_alias_tables(self):
+        for position in range(len(self.target_c)):
+            a = self.source_a[self.target_source[position]]
+            b = self.source_b[self.target_source[position]]
+            self.target_weights[position] = abs(self.hamiltonian.find_v2mat(self.target_c[position], self.target_d[position], a, b))
+        self.source_sizes = np.bincount(self.target_source, minlength=len(self.source_a))
+        self.source_offsets = np.concatenate(([0], np.cumsum(self.source_sizes)[:-1])).astype(np.int64)
+        for source in range(len(self.source_a)):
+            start = self.source_offsets[source]
+            end = start + self.source_sizes[source]
+            weights = self.target_weights[start:end]
+            self.source_weights[source] = np.sum(weights)
+            prob, alias = build_alias_table(weights)
+            self.alias_prob[start:end] = prob
+            self.alias_index[start:end] = alias + start
+
+    # count double excitations of bits at once; failed attempts have invp = 0
+    def double_excite_batch(self, bits: int, count: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        a = np.zeros(count, dtype=np.int64)
+        b = np.zeros(count, dtype=np.int64)
+        c = np.zeros(count, dtype=np.int64)
+        d = np.zeros(count, dtype=np.int64)
+        invp = np.zeros(count)
+        D = int_to_words(bits, self.k)
+        source_occupied = np.all((self.source_masks & D) == self.source_masks, axis=1)
+        free = source_occupied[self.target_source] & np.all((self.target_masks & D) == 0, axis=1)
+        usable = np.zeros(len(self.source_masks), dtype=bool)
+        usable[self.target_source[free]] = True
+        sources = np.flatnonzero(usable)
+        if count == 0 or len(sources) == 0:
+            return (a, b, c, d, invp)
+        chosen = sources[rng.integers(0, len(sources), size=count)]
+        positions = self.source_offsets[chosen] + (rng.random(count) * self.source_sizes[chosen]).astype(np.int64)
+        positions = np.where(rng.random(count) < self.alias_prob[positions], positions, self.alias_index[positions])
+        accepted = free[positions]
+        a = self.source_a[chosen]
+        b = self.source_b[chosen]
+        c = self.target_c[positions]
+        d = self.target_d[positions]
+        invp[accepted] = len(sources) * self.source_weights[chosen[accepted]] / self.target_weights[positions[accepted]]
+        return (a, b, c, d, invp)
@@ -21,6 +21,8 @@ class FCI:
         self.eigenvalues = np.array([])  # all eigenvalues
         self.eigenvectors = np.array([])  # all eigenvectors
         self.emin = None  # ground-state energy
+        self.ground_state = np.array([])  # ground-state eigenvector
+        self.converged = False  # whether the last solve_davidson reached tol
 
     # build all possible configurations
     def build_configurations(self):
@@ -44,6 +46,46 @@ class FCI:
         self.eigenvalues, self.eigenvectors = np.linalg.eig(self.hamil_matrix)
         self.emin = np.real(np.min(self.eigenvalues))
 
+    # lowest eigenpair only, by Davidson iterations with the diagonal preconditioner
+    # guess: starting vector, e.g. the ground state at a neighbouring g; the lowest diagonal configuration when None
+    # return whether the residual norm reached tol within max_iter iterations (emin is the last Ritz value either way)
+    def solve_davidson(self, guess: np.ndarray = None, tol: float = 1e-10, max_iter: int = 200, max_subspace: int = 30) -> bool:
+        H = self.hamil_matrix
+        diag = np.diag(H)
+        if guess is not None and len(guess) != self.dim:
+            raise ValueError(f"error: Davidson guess has length {len(guess)}, the FCI dimension is {self.dim}")
+        if guess is None:
+            guess = np.zeros(self.dim)
+            guess[np.argmin(diag)] = 1.0
+        V = (guess / np.linalg.norm(guess))[:, None]
+        theta, x = 0.0, V[:, 0]
+        self.converged = False
+        for _ in range(max_iter):
+            HV = H @ V
+            w, y = np.linalg.eigh(V.T @ HV)
+            theta, x = w[0], V @ y[:, 0]
+            r = HV @ y[:, 0] - theta * x
+            if np.linalg.norm(r) < tol:
+                self.converged = True
+                break
+            denominator = theta - diag
+            denominator[np.abs(denominator) < 1e-12] = 1e-12
+            t = r / denominator
+            for _ in range(2):
+                t -= V @ (V.T @ t)
+            norm = np.linalg.norm(t)
+            if norm < 1e-14:
+                break
+            if V.shape[1] >= max_subspace:
+                # restart from the current Ritz vector, t is already orthogonal to it
+                V = x[:, None] / np.linalg.norm(x)
+            V = np.hstack((V, (t / norm)[:, None]))
+        self.emin = float(theta)
+        self.ground_state = x / np.linalg.norm(x)
+        if not self.converged:
+            print(f"! Davidson not converged within {max_iter} iterations, E = {self.emin}")
+        return self.converged
+
     def print_states(self, show_vectors=False):
         print(self.eigenvalues)
         if show_vectors:
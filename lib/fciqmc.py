@@ -1,12 +1,24 @@
 import math
-import random
+import time
+
+import numpy as np
 
 from .profiler import *
 from .basis import *
 from .hamiltonian import *
+from .walkers import *
+from .excitation import *
+from .pairspace import *
+from .semistochastic import *
+from .checkpoint import *
+from .trace import *
+from .reblock import *
+from .timestep import *
+from .spectral import *
 
 
 class FCIQMC:
+    # basis, hamil: Basis and Hamiltonian, or PairBasis and PairHamiltonian for the seniority-zero pair space
     def __init__(self, basis: Basis, hamil: Hamiltonian, params: dict, n: int):
         self.basis: Basis = basis
         self.hamiltonian: Hamiltonian = hamil
@@ -21,67 +33,162 @@ class FCIQMC:
         self.zeta: float = params["zeta"]
         self.steps: int = params["steps"]
         self.initiator_threshold: int = params["initiator_threshold"]
-        self.onebody_probability: float = 0.5
+        # excitation generator: "uniform" samples whole symmetry channels, "symmetric" only nonzero matrix elements,
+        # "heat_bath" nonzero matrix elements weighted by |v_{cdab}|
+        self.excitation_type: str = params.get("excitation", "uniform")
+        # the basis itself is the uniform generator (Basis or PairBasis)
+        if self.excitation_type == "uniform":
+            self.excitation = self.basis
+        elif isinstance(self.basis, PairBasis):
+            raise ValueError(f"error: pair space only supports the uniform excitation generator, got {self.excitation_type}")
+        elif self.excitation_type == "symmetric":
+            self.excitation = SymmetricExcitation(self.basis, self.hamiltonian)
+        elif self.excitation_type == "heat_bath":
+            self.excitation = HeatBathExcitation(self.basis, self.hamiltonian)
+        else:
+            raise ValueError(f"error: unknown excitation generator {self.excitation_type}")
+        self.onebody_probability: float = self.excitation.onebody_probability
         self.twobody_probability: float = 1.0 - self.onebody_probability
         self.min_spawn_num: float = 0.01
         self.min_walker_num: float = 0.01
+        self.rng: np.random.Generator = np.random.default_rng(params.get("seed"))
         self.D0: Det = basis.minimum_det(self.particle_number)
         self.E0: float = self.hamiltonian.Hmat0(self.D0)
         self.S: float = self.E0
-        self.walkers: dict = {self.D0: (self.initial_walkers, self.E0)}
-        self.new_walkers: List[Tuple[Det, bool, float]] = []
-        self.tau_trace: List[float] = []
-        self.number_trace: List[float] = []
-        self.shift_trace: List[float] = []
-        self.energy_trace: List[float] = []
+        # H_0i of every determinant connected to D0, D0 itself included with H_00 = E0
+        self.reference_connections: Dict[int, float] = self.build_reference_connections()
+        # the same map as sorted arrays for vectorized lookups in annihilation
+        reference_words = DetArray.from_ints(self.reference_connections.keys(), self.NMO).words
+        reference_order = np.argsort(det_keys(reference_words))
+        self.reference_dets: np.ndarray = reference_words[reference_order]
+        self.reference_values: np.ndarray = np.array(list(self.reference_connections.values()))[reference_order]
+        # running estimators: sum_i Ni H_0i and sum_i |Ni|, updated wherever a population changes
+        self.energy_numerator: float = 0.0
+        self.total_number: float = 0.0
+        # semi-stochastic core space: None (fully stochastic), "doubles" (D0 and its connections)
+        # or an int K (the K most populated determinants when start begins); built at the beginning of start
+        self.core_space_type = params.get("core_space")
+        self.core: Optional[CoreSpace] = None
+        self.walkers: WalkerList = WalkerList(self.NMO)
+        self.reset_walkers()
+        # walkers spawned in the current step
+        self.new_walkers: SpawnBuffer = SpawnBuffer(self.NMO)
+        # samples of every shift update, in memory or in the column files under params["trace_path"]
+        self.trace: TraceSink = TraceSink(params.get("trace_path"))
+        # streaming reblocking of (S, sum_i Ni H_0i, N0, Nw), fed from step reblock_start * steps of start on, or from
+        # step equilibration_steps when target_error is set (see reblock_begin)
+        self.reblock_start: float = params.get("reblock_start", 0.5)
+        self.equilibration_steps: Optional[int] = params.get("equilibration_steps")
+        self.reblock: ReblockAccumulator = ReblockAccumulator(4)
+        # steps done in start and the walker number at the last shift update, saved in checkpoints
+        self.step_count: int = 0
+        self.shift_number: float = 0.0
+        # adaptive d_tau (params["d_tau_control"]): adjusted every warm up step and after every shift update of start
+        # until the reblocking begins, see TimeStepController
+        self.d_tau_control: bool = params.get("d_tau_control", False)
+        self.time_step: TimeStepController = TimeStepController(params.get("bloom_limit", 1.0), params.get("bloom_percentile", 99.0), params.get("bloom_max", 10.0), params.get("d_tau_max"))
+        # largest Hii known, for the diagonal bound of the adaptive d_tau: sampled by SpectralBounds on the first
+        # adjustment (or by the "auto" settings), then raised to every diagonal the walkers reach
+        self.max_diagonal: Optional[float] = None
+        self.spectral_seed: Optional[int] = params.get("seed")
+        # imaginary time of start at step tau_step, so step i is at tau_offset + d_tau * (i - tau_step)
+        self.tau_offset: float = 0.0
+        self.tau_step: int = 0
+        # params "d_tau" and "initiator_threshold" may be "auto": chosen from the spectral range before any sampling
+        if self.d_tau == "auto" or self.initiator_threshold == "auto":
+            self.apply_spectral_bounds(params.get("seed"))
+        # start writes a checkpoint every checkpoint_interval steps when checkpoint_file is set
+        self.checkpoint_file: Optional[str] = params.get("checkpoint_file")
+        self.checkpoint_interval: int = params.get("checkpoint_interval", 1000)
+        self.checkpoint_writer: CheckpointWriter = CheckpointWriter()
+        # early termination of start: once the reblocked error of E reaches target_error (steps stays the upper
+        # bound), or after time_limit seconds of wall clock, with a final checkpoint to resume from
+        self.target_error: Optional[float] = params.get("target_error")
+        self.time_limit: Optional[float] = params.get("time_limit")
+        # samples, and blocks at the plateau level, needed before the error is trusted; the plateau criterion is met
+        # by chance with a handful of samples, and the error at a level with B blocks is itself uncertain by about
+        # 1 / sqrt(2 (B - 1)): 16 blocks leave ~18% (4 blocks would leave ~40% and stop on underestimated errors)
+        # the plateau level climbs as samples come in, so 16 blocks there take about 1000 samples
+        self.target_error_samples: int = params.get("target_error_samples", 128)
+        self.target_error_blocks: int = params.get("target_error_blocks", 16)
+        # why the last start returned: "steps", "target_error" or "time_limit"
+        self.stop_reason: Optional[str] = None
+
+    # set the "auto" d_tau and initiator threshold from SpectralBounds
+    def apply_spectral_bounds(self, seed: Optional[int] = None):
+        bounds = SpectralBounds(self.basis, self.hamiltonian, self.particle_number, seed=seed)
+        bounds.analyze()
+        bounds.print_bounds()
+        self.max_diagonal = bounds.max_diag
+        if self.d_tau == "auto":
+            self.d_tau = bounds.suggest_d_tau()
+        if self.initiator_threshold == "auto":
+            self.initiator_threshold = bounds.suggest_initiator_threshold(self.d_tau)
+        print(f"d_tau: {self.d_tau:.3e}, initiator threshold: {self.initiator_threshold}")
+
+    # map from the determinants connected to D0 to their nonzero H_0i
+    def build_reference_connections(self) -> Dict[int, float]:
+        connections = {self.D0.bits: self.E0}
+        for bits in self.basis.connected_dets(self.D0.bits):
+            H0i = self.hamiltonian.Hmat(self.D0, Det.from_int(bits, self.NMO))
+            if H0i != 0.0:
+                connections[bits] = H0i
+        return connections
+
+    # recompute the running estimators from the walker arrays
+    def refresh_estimators(self):
+        pops = self.walkers.get_pops()
+        self.energy_numerator = float(np.dot(pops, self.walkers.get_refs()))
+        self.total_number = float(np.abs(pops).sum())
 
     # get total walker number Nw
     def get_number(self) -> float:
-        sum_walkers = sum(abs(value[0]) for value in self.walkers.values())
-        return sum_walkers
+        return self.total_number
+
+    # population on D0
+    def get_reference_number(self) -> float:
+        slot = self.walkers.find(self.D0.bits)
+        if slot < 0:
+            raise ValueError("error: cannot find D0 in all configurations...")
+        N0 = float(self.walkers.pops[slot])
+        if N0 == 0.0:
+            raise ValueError("error: number of walkers on D0 is 0")
+        return N0
 
     # get projected energy
     def get_energy(self) -> float:
-        energy = 0.0
-        D0_data = self.walkers.get(self.D0)
-        if D0_data is None:
-            raise ValueError("error: cannot find D0 in all configurations...")
-        else:
-            N0 = D0_data[0]
-            if N0 == 0.0:
-                raise ValueError("error: number of walkers on D0 is 0")
-            for Di, (Ni, Hii) in self.walkers.items():
-                if Ni == 0.0:
-                    continue
-                H0i = self.hamiltonian.Hmat(self.D0, Di)
-                if H0i == 0.0:
-                    continue
-                energy += Ni * H0i
-        return energy / N0
+        return self.energy_numerator / self.get_reference_number()
 
     # get projected energy and total walker number Nw
     def get_energy_and_number(self) -> Tuple[float, float]:
-        energy = 0.0
-        if self.D0 not in self.walkers:
-            raise ValueError("error: cannot find D0 in all configurations...")
-        else:
-            N0, E0 = self.walkers[self.D0]
-            Nsum = 0.0
-            if N0 == 0.0:
-                raise ValueError("error: number of walkers on D0 is 0")
-            for Di, (Ni, Hii) in self.walkers.items():
-                H0i = self.hamiltonian.Hmat(self.D0, Di)
-                if (H0i == 0.0) and (Ni == 0.0):
-                    continue
-                energy += Ni * H0i
-                Nsum += abs(Ni)
-        return (energy / N0, Nsum)
+        return (self.energy_numerator / self.get_reference_number(), self.total_number)
+
+    # get (sum_i Ni H_0i, N0, Nw, number of occupied determinants)
+    def get_estimators(self) -> Tuple[float, float, float, int]:
+        return (self.energy_numerator, self.get_reference_number(), self.total_number, len(self.walkers))
+
+    # views of the trace columns
+    @property
+    def tau_trace(self) -> np.ndarray:
+        return self.trace.column("tau")
+
+    @property
+    def number_trace(self) -> np.ndarray:
+        return self.trace.column("Nw")
+
+    @property
+    def shift_trace(self) -> np.ndarray:
+        return self.trace.column("S")
+
+    @property
+    def energy_trace(self) -> np.ndarray:
+        return self.trace.energy()
 
     # get mean and error of S, E, Nw
     def get_statistics(self, pos: float):
         if pos <= 0 or pos >= 1:
             raise ValueError("error: pos must be : 0 < pos < 1")
-        start_index = int(pos * len(self.energy_trace))
+        start_index = int(pos * len(self.trace))
         stat_energy = self.energy_trace[start_index:]
         stat_shift = self.shift_trace[start_index:]
         stat_number = self.number_trace[start_index:]
@@ -93,6 +200,31 @@ class FCIQMC:
         number_deviation = np.std(stat_number, ddof=1)
         return shift_mean, shift_deviation, energy_mean, energy_deviation, number_mean, number_deviation
 
+    # reblocked mean, error at the plateau and correlation time (in samples, one sample every A steps) of S, E, Nw
+    def get_reblock_statistics(self) -> Dict[str, dict]:
+        if len(self.reblock) < 2:
+            raise ValueError("error: not enough samples for reblocking")
+        return {"S": self.reblock.statistics(0), "E": self.reblock.ratio_statistics(1, 2), "Nw": self.reblock.statistics(3)}
+
+    # step of start from which samples enter the reblocking
+    # a run stopping at target_error begins after a fixed equilibration, not a fraction of its upper bound steps;
+    # by default a few damping times A / xi of the shift, which starts varying at the first step of start
+    def reblock_begin(self) -> float:
+        if self.target_error is None:
+            return self.reblock_start * self.steps
+        if self.equilibration_steps is not None:
+            return self.equilibration_steps
+        return 5.0 * self.A / self.xi
+
+    # reblocked error of E has reached its plateau, with enough blocks there, and is at most target_error even one
+    # standard error of the error above its estimate
+    def reached_target_error(self) -> bool:
+        if self.target_error is None or len(self.reblock) < self.target_error_samples:
+            return False
+        E = self.reblock.ratio_statistics(1, 2)
+        level = E["optimal_level"]
+        return level is not None and self.reblock.counts[level] >= self.target_error_blocks and E["error"] + E["error_error"] <= self.target_error
+
     # print statistics of S, E, Nw
     def print_statistics(self, pos: float):
         S_mean, S_std, E_mean, E_std, N_mean, N_std = self.get_statistics(pos)
@@ -102,86 +234,131 @@ class FCIQMC:
         print(f"E error = {E_std}")
         # print(f"N mean = {N_mean}")
         # print(f"N error = {N_std}")
+        if len(self.reblock) >= 2:
+            E = self.get_reblock_statistics()["E"]
+            plateau = "" if E["optimal_level"] is not None else " (no plateau yet, largest block shown)"
+            print(f"E reblocked = {E['mean']} +/- {E['error']}{plateau}")
+            print(f"E correlation time = {E['correlation_time'] * self.A * self.d_tau} (tau)")
 
-    # cut the absolute value of num to target
-    def abs_cut_to(self, num: float, target: float) -> float:
-        abs_num = abs(num)
-        if abs_num >= target:
-            return num
-        else:
-            sign = 1.0 if num >= 0 else -1.0
-            return sign * target * float(random.uniform(0, target) < abs_num)
-
-    # cut walker number to min_walker_num
-    def walker_num_cut(self, num: float) -> float:
-        abs_num = abs(num)
-        if abs_num >= self.min_walker_num:
-            return num
-        else:
-            sign = 1.0 if num >= 0 else -1.0
-            return sign * self.min_walker_num * float(random.uniform(0, self.min_walker_num) < abs_num)
+    # cut the absolute values of num to target, stochastically rounding smaller ones
+    def abs_cut_to(self, num: np.ndarray, target: float) -> np.ndarray:
+        abs_num = np.abs(num)
+        keep = self.rng.uniform(0, target, size=abs_num.shape) < abs_num
+        return np.where(abs_num >= target, num, np.where(num >= 0, 1.0, -1.0) * target * keep)
+
+    # cut walker numbers to min_walker_num
+    def walker_num_cut(self, num: np.ndarray) -> np.ndarray:
+        return self.abs_cut_to(num, self.min_walker_num)
+
+    # spawn from determinant bits (diagonal energy Hii) with Ni walkers, all attempts at once
+    # return target words (n, K), signed spawn amplitudes, initiator flags and target diagonal energies
+    def spawn(self, bits: int, Ni: int, is_initiator: bool, Hii: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        Di = Det.from_int(bits, self.NMO)
+        parent = DetArray.from_ints([bits], self.NMO)
+        count = abs(Ni)
+        single_count = int(self.rng.binomial(count, self.onebody_probability))
+        a, b, invp = self.excitation.single_excite_batch(bits, single_count, self.rng)
+        ok = invp > 0
+        a, b, invp = a[ok], b[ok], invp[ok]
+        single_targets = parent.flip(a).flip(b).words
+        single_amps = self.hamiltonian.Hmat1_batch(Di, a, b) * invp / self.onebody_probability
+        single_diags = self.hamiltonian.Hmat0_single_batch(Hii, Di, a, b)
+        a, b, c, d, invp = self.excitation.double_excite_batch(bits, count - single_count, self.rng)
+        ok = invp > 0
+        a, b, c, d, invp = a[ok], b[ok], c[ok], d[ok], invp[ok]
+        double_targets = parent.flip(a).flip(b).flip(c).flip(d).words
+        double_amps = self.hamiltonian.Hmat2_batch(Di, a, b, c, d) * invp / self.twobody_probability
+        double_diags = self.hamiltonian.Hmat0_double_batch(Hii, Di, a, b, c, d)
+        targets = np.concatenate((single_targets, double_targets))
+        diags = np.concatenate((single_diags, double_diags))
+        rates = np.concatenate((single_amps, double_amps))
+        if self.d_tau_control:
+            self.time_step.record(rates)
+        spawn_nums = -sign(Ni) * self.d_tau * rates
+        spawn_nums = self.abs_cut_to(spawn_nums, self.min_spawn_num)
+        nonzero = spawn_nums != 0.0
+        if self.core is not None and bits in self.core.bit_set:
+            # core -> core spawns are replaced by the deterministic projection
+            nonzero &= ~self.core.contains(targets)
+        return (targets[nonzero], spawn_nums[nonzero], np.full(np.count_nonzero(nonzero), is_initiator), diags[nonzero])
 
     # walker evolution step
     def step(self):
-        for Di, (ci, Hii) in list(self.walkers.items()):
-            Di: Det
-            ci: float
-            Hii: float
-            Ci = self.walker_num_cut(ci)
-            if Ci == 0.0:
-                del self.walkers[Di]
-                continue
-            Ni = math.floor(Ci + random.uniform(0, 1))
-            pd = self.d_tau * (Hii - self.S)
-            self.walkers[Di] = (ci - pd * Ni, Hii)  # diagonal step
-            is_initiator = self.is_initiator and (abs(Ci) > self.initiator_threshold)
-            for dummy in range(abs(Ni)):
-                Df = Di.copy()
-                invp = 0.0
-                Hfi = 0.0
-                if random.uniform(0, 1) < self.onebody_probability:
-                    a, b, local_invp = self.basis.single_excite(Di)
-                    if local_invp == 0:
-                        continue
-                    invp = local_invp / self.onebody_probability
-                    Df.reset(a)
-                    Hfi = self.hamiltonian.Hmat1(Df, a, b)
-                    Df.set(b)
-                else:
-                    a, b, c, d, local_invp = self.basis.double_excite(Di)
-                    if local_invp == 0:
-                        continue
-                    invp = local_invp / self.twobody_probability
-                    Df.reset(a)
-                    Df.reset(b)
-                    Hfi = self.hamiltonian.Hmat2(Df, a, b, c, d)
-                    Df.set(c)
-                    Df.set(d)
-                spawn_num = -sign(Ni) * self.d_tau * Hfi * invp
-                spawn_num = self.abs_cut_to(spawn_num, self.min_spawn_num)
-                if spawn_num == 0.0:
-                    continue
-                self.new_walkers.append((Df, is_initiator, spawn_num))
-
-    # walker annihilation step
+        # walkers spawned in this step are only merged in annihilation, so the slots are stable here
+        pops = self.walkers.get_pops()
+        diags = self.walkers.get_diags()
+        core = self.walkers.get_core()
+        Ci = self.walker_num_cut(pops)
+        Ci[core] = pops[core]  # core amplitudes are propagated exactly
+        Ni = np.floor(Ci + self.rng.random(len(Ci))).astype(np.int64)
+        changed = np.flatnonzero((Ni != 0) | (Ci == 0.0) | core)
+        old_pops = pops[changed]
+        pops -= self.d_tau * (diags - self.S) * np.where(core, Ci, Ni)  # diagonal step
+        pops[Ci == 0.0] = 0.0  # dead slots, removed in annihilation
+        if self.core is not None:
+            # walkers and core.dets share the sort order, so the core slots line up with the core Hamiltonian
+            pops[core] -= self.d_tau * self.core.multiply(Ci[core])
+        new_pops = pops[changed]
+        self.energy_numerator += float(np.dot(new_pops - old_pops, self.walkers.refs[changed]))
+        self.total_number += float(np.abs(new_pops).sum() - np.abs(old_pops).sum())
+        is_initiator = self.is_initiator & ((np.abs(Ci) > self.initiator_threshold) | core)
+        spawning = np.flatnonzero(Ni)
+        parents = DetArray(self.walkers.get_dets()[spawning], self.NMO).to_ints()
+        for slot, bits in zip(spawning.tolist(), parents):
+            self.new_walkers.append(*self.spawn(bits, int(Ni[slot]), bool(is_initiator[slot]), float(diags[slot])))
+
+    # H_0i of (n, K) determinant words, 0 for determinants not connected to D0
+    def reference_couplings(self, words: np.ndarray) -> np.ndarray:
+        positions = search_sorted_dets(self.reference_dets, words)
+        return np.where(positions >= 0, self.reference_values[positions], 0.0)
+
+    # walker annihilation step: spawns onto the same target are summed after a sort, the initiator rule is applied
+    # per target (kept if the target is occupied or any spawn onto it came from an initiator) and new targets
+    # are merged into the sorted walker list in one pass
     def annihilation(self):
-        for Df, is_initiator, spawn_num in self.new_walkers:
-            if (Df not in self.walkers) and (not is_initiator):
-                continue
-            else:
-                if Df in self.walkers:
-                    current_num, current_energy = self.walkers[Df]
-                    new_num = current_num + spawn_num
-                    if new_num == 0.0:
-                        del self.walkers[Df]
-                        continue
-                    else:
-                        self.walkers[Df] = (new_num, current_energy)
-                else:
-                    new_num = spawn_num
-                    current_energy = self.hamiltonian.Hmat0(Df)
-                    self.walkers[Df] = (new_num, current_energy)
+        walkers = self.walkers
+        if len(self.new_walkers) == 0:
+            walkers.compact()
+            return
+        # target diagonal energies were derived from the parents at spawn time
+        targets, spawn_nums, initiators, target_diags = combine_spawns(*self.new_walkers.get_columns())
         self.new_walkers.clear()
+        slots = walkers.find_batch(targets)
+        stored = slots >= 0
+        # slots emptied earlier in this step count as unoccupied, core determinants are always occupied
+        occupied = np.zeros(len(slots), dtype=bool)
+        occupied[stored] = (walkers.pops[slots[stored]] != 0.0) | walkers.core[slots[stored]]
+        accepted = (occupied | initiators) & (spawn_nums != 0.0)
+        update = np.flatnonzero(accepted & stored)
+        old_pops = walkers.pops[slots[update]]
+        walkers.pops[slots[update]] = old_pops + spawn_nums[update]
+        self.total_number += float(np.abs(old_pops + spawn_nums[update]).sum() - np.abs(old_pops).sum())
+        self.energy_numerator += float(np.dot(spawn_nums[update], walkers.refs[slots[update]]))
+        new = np.flatnonzero(accepted & ~stored)
+        new_refs = self.reference_couplings(targets[new])
+        self.total_number += float(np.abs(spawn_nums[new]).sum())
+        self.energy_numerator += float(np.dot(spawn_nums[new], new_refs))
+        walkers.merge(targets[new], spawn_nums[new], target_diags[new], new_refs)
+        walkers.compact()
+
+    # reset walkers to the initial population on D0
+    def reset_walkers(self):
+        self.core = None
+        self.walkers.clear()
+        self.walkers.add(self.D0.bits, self.initial_walkers, self.E0, self.E0)
+        self.refresh_estimators()
+
+    # replace the walkers by (n, K) determinant words with populations pops and set the shift, e.g. to continue from
+    # the converged walkers of a neighbouring parameter; diagonal energies and H_0i come from this Hamiltonian
+    def seed_walkers(self, words: np.ndarray, pops: np.ndarray, S: float):
+        order = np.argsort(det_keys(words), kind="stable")
+        words, pops = words[order], pops[order]
+        diags = np.array([self.hamiltonian.Hmat0(Det.from_int(bits, self.NMO)) for bits in DetArray(words, self.NMO).to_ints()])
+        self.core = None
+        self.walkers.clear()
+        self.walkers.merge(words, pops.astype(float), diags, self.reference_couplings(words))
+        self.refresh_estimators()
+        self.S = S
 
     # warm up step
     def warm(self):
@@ -194,46 +371,145 @@ class FCIQMC:
             energy, total_number = self.get_energy_and_number()
             if warm_up_count % self.A == 0:
                 print(f"{warm_up_count:>6}{total_number:>12.3f}{energy:>16.3f}")
+            if self.d_tau_control:
+                self.adjust_d_tau()
         print(f"warm up steps: {warm_up_count}")
 
-    # search optimal d_tau in warm up step
+    # set d_tau to the value suggested by the spawn rates seen so far, within the diagonal bound; return whether it
+    # changed
+    def adjust_d_tau(self) -> bool:
+        if self.max_diagonal is None:
+            bounds = SpectralBounds(self.basis, self.hamiltonian, self.particle_number, seed=self.spectral_seed)
+            bounds.sample_diagonals()
+            self.max_diagonal = bounds.max_diag
+        if len(self.walkers) > 0:
+            self.max_diagonal = max(self.max_diagonal, float(self.walkers.get_diags().max()))
+        d_tau = self.time_step.suggest(self.d_tau, self.max_diagonal - self.S)
+        if d_tau == self.d_tau:
+            return False
+        self.d_tau = d_tau
+        return True
+
+    # warm up from D0 with the adaptive d_tau, starting from params["d_tau"]; start keeps the d_tau found here
+    # unless params["d_tau_control"] is set
     def warm_search(self):
-        warm_up_steps_max = 1e4
-        for d_tau_now in np.logspace(-9, -1, num=100):
-            self.d_tau = d_tau_now
-            self.walkers = {self.D0: (self.initial_walkers, self.E0)}
-            warm_up_count = 0
-            total_number = self.get_number()
-            while total_number < self.target_walker_number:
-                warm_up_count += 1
-                self.step()
-                self.annihilation()
-                energy, total_number = self.get_energy_and_number()
-                if warm_up_count % self.A == 0:
-                    print(f"{warm_up_count:>6}{total_number:>12.3f}{energy:>16.3f}")
-                if warm_up_count > warm_up_steps_max:
-                    break
-            if warm_up_count < warm_up_steps_max:
-                break
-            print(f"warm up steps: {warm_up_count}")
+        control = self.d_tau_control
+        self.d_tau_control = True
+        self.reset_walkers()
+        self.warm()
+        self.d_tau_control = control
+        print(f"d_tau: {self.d_tau:.3e}")
+
+    # choose the core space and keep its determinants in the walker list for good
+    def build_core_space(self):
+        if self.core_space_type == "doubles":
+            bits = list(self.reference_connections.keys())
+        elif isinstance(self.core_space_type, int):
+            largest = np.argsort(-np.abs(self.walkers.get_pops()), kind="stable")[: self.core_space_type]
+            bits = DetArray(self.walkers.get_dets()[largest], self.NMO).to_ints() + [self.D0.bits]
+        else:
+            raise ValueError(f"error: unknown core space {self.core_space_type}")
+        self.core = CoreSpace(self.basis, self.hamiltonian, bits)
+        slots = self.walkers.find_batch(self.core.dets)
+        self.walkers.core[slots[slots >= 0]] = True
+        missing = self.core.dets[slots < 0]
+        diags = np.array([self.hamiltonian.Hmat0(Det.from_int(bits, self.NMO)) for bits in DetArray(missing, self.NMO).to_ints()])
+        self.walkers.merge(missing, np.zeros(len(missing)), diags, self.reference_couplings(missing), np.ones(len(missing), dtype=bool))
+        print(f"core space: {len(self.core)} determinants, {len(self.core.values)} off-diagonal elements")
 
     # start FCIQMC algorithm
     def start(self):
+        if self.core_space_type is not None and self.core is None:
+            self.build_core_space()
         print("! evolution begins")
         print(f"!{'step':>5}{'S':>16}{'E':>16}{'Nw':>16}")
         energy = self.get_energy()
-        new_num = self.get_number()
-        old_num = new_num
-        for i in range(self.steps):
+        # a run restored from a checkpoint continues from its saved step
+        if self.step_count == 0:
+            self.shift_number = self.get_number()
+            self.trace.truncate(0)
+            self.reblock.clear()
+            self.tau_offset = 0.0
+            self.tau_step = 0
+        begin = time.time()
+        self.stop_reason = "steps"
+        while self.step_count < self.steps:
+            i = self.step_count
             self.step()
             self.annihilation()
             if i % self.A == 0:
-                old_num = new_num
-                energy, new_num = self.get_energy_and_number()
+                old_num = self.shift_number
+                numerator, N0, new_num, dets = self.get_estimators()
+                energy = numerator / N0
+                self.shift_number = new_num
                 print(f"{i:>6}{self.S:>16.3f}{energy:>16.3f}{new_num:>16.3e}")
-                self.tau_trace.append(self.d_tau * i)
-                self.number_trace.append(new_num)
-                self.shift_trace.append(self.S)
-                self.energy_trace.append(energy)
+                self.trace.append(i, self.tau_offset + self.d_tau * (i - self.tau_step), self.S, numerator, N0, new_num, dets)
+                if i >= self.reblock_begin():
+                    self.reblock.add((self.S, numerator, N0, new_num))
+                # d_tau only changes right after a shift update, so A * d_tau is the time since the last one
                 self.S = self.S - self.xi / (self.A * self.d_tau) * math.log(new_num / old_num) - self.zeta / (self.A * self.d_tau) * math.log(new_num / self.target_walker_number)
+                # d_tau is frozen once the reblocking begins, so all statistics share one time step
+                if self.d_tau_control and i + self.A < self.reblock_begin():
+                    old_d_tau = self.d_tau
+                    if self.adjust_d_tau():
+                        self.tau_offset += old_d_tau * (i + 1 - self.tau_step)
+                        self.tau_step = i + 1
+                        print(f"d_tau: {old_d_tau:.3e} -> {self.d_tau:.3e}")
+                if self.reached_target_error():
+                    self.stop_reason = "target_error"
+            self.step_count += 1
+            if self.checkpoint_file is not None and self.step_count % self.checkpoint_interval == 0:
+                self.save_checkpoint()
+            if self.stop_reason == "steps" and self.time_limit is not None and time.time() - begin > self.time_limit:
+                self.stop_reason = "time_limit"
+                if self.checkpoint_file is not None:
+                    self.save_checkpoint(background=False)
+            if self.stop_reason != "steps":
+                break
+        self.checkpoint_writer.wait()
+        self.trace.flush()
+        if self.stop_reason != "steps":
+            print(f"! stopped early at step {self.step_count}: {self.stop_reason}")
         print("! evolution ends")
+
+    # write the walkers, shift, step counter, traces and random state to path (default checkpoint_file)
+    # background: write on a thread and return right after the state is copied
+    def save_checkpoint(self, path: Optional[str] = None, background: bool = True):
+        path = path if path is not None else self.checkpoint_file
+        if path is None:
+            raise ValueError("error: no checkpoint file given")
+        snapshot = take_snapshot(self)
+        if background:
+            self.checkpoint_writer.submit(path, snapshot)
+        else:
+            self.checkpoint_writer.wait()
+            write_checkpoint(path, snapshot)
+
+    # restore the state saved by save_checkpoint; start then resumes the run exactly where it was saved
+    def load_checkpoint(self, path: str):
+        checkpoint = read_checkpoint(path)
+        header, arrays = checkpoint["header"], checkpoint["arrays"]
+        if header["nmo"] != self.NMO:
+            raise ValueError(f"error: checkpoint has {header['nmo']} orbitals, the basis has {self.NMO}")
+        self.walkers.clear()
+        self.walkers.merge(arrays["dets"], arrays["pops"], arrays["diags"], arrays["refs"], arrays["core"])
+        core_bits = DetArray(arrays["dets"][arrays["core"]], self.NMO).to_ints()
+        self.core = CoreSpace(self.basis, self.hamiltonian, core_bits) if core_bits else None
+        self.S = header["S"]
+        self.d_tau = header["d_tau"]
+        self.energy_numerator = header["energy_numerator"]
+        self.total_number = header["total_number"]
+        self.step_count = header["step_count"]
+        self.shift_number = header["shift_number"]
+        self.tau_offset = header["tau_offset"]
+        self.tau_step = header["tau_step"]
+        self.time_step.set_state(header["time_step"])
+        self.max_diagonal = header["max_diagonal"]
+        # a file-backed trace already holds the samples up to the checkpoint, later ones are dropped
+        self.trace.truncate(header["trace_length"] if self.trace.path is not None else 0)
+        if self.trace.path is None:
+            self.trace.extend(dict(zip(header["trace_columns"], arrays["traces"].reshape(len(header["trace_columns"]), header["trace_length"]))))
+        self.rng.bit_generator.state = header["numpy_rng"]
+        self.reblock.set_state(header["reblock"])
+        version, state, gauss = header["python_random"]
+        random.setstate((version, tuple(state), gauss))
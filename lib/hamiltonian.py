@@ -2,19 +2,36 @@ import numpy as np
 
 from .mymath import *
 from .basis import *
+from .cache import *
 
 
 class Hamiltonian:
     # basis: one-body basis structure
     # g: pairing-interaction strength
-    def __init__(self, basis: Basis, g: float = 0.1, ini: bool = True):
+    # cache_size: capacity of the matrix-element cache of the scalar lookups (see enable_cache), 0 disables it
+    # cache_policy: eviction policy of the cache, "lru" or "fifo"
+    def __init__(self, basis: Basis, g: float = 0.1, ini: bool = True, cache_size: int = 0, cache_policy: str = "lru"):
         self.basis: Basis = basis
         self.NMO: int = self.basis.NMO
         self.g: float = g
+        self.cache: Optional[MatrixElementCache] = None
+        if cache_size > 0:
+            self.enable_cache(cache_size, cache_policy)
         if ini:
             self.v0mat: float = 0.0
             self.ch_v1mat: np.ndarray = self.init_v1mat()
-            self.ch_v2mat: List[np.ndarray] = self.init_v2mat()
+            # flat integral store: all channel blocks of v2 in one contiguous array, ch_v2mat are views into it
+            self.v2flat: np.ndarray = np.zeros(0)
+            self.v2offsets: np.ndarray = np.zeros(0, dtype=np.int64)
+            self.v2sizes: np.ndarray = np.zeros(0, dtype=np.int64)
+            self.ch_v2mat: List[np.ndarray] = []
+            self.init_v2flat(self.init_v2mat())
+            # (a, b) -> (channel, position) index for any orbital order, with the antisymmetry sign of (a, b)
+            self.pair_channel: np.ndarray = np.zeros(0, dtype=np.int64)
+            self.pair_position: np.ndarray = np.zeros(0, dtype=np.int64)
+            self.pair_sign: np.ndarray = np.zeros(0)
+            self.init_pair_index()
+            self.v2diag: np.ndarray = self.init_v2diag()
 
     # initialize one-body matrix elements
     def init_v1mat(self) -> np.ndarray:
@@ -65,71 +82,176 @@ class Hamiltonian:
             ch_v2mat.append(ch_v2mat_this)
         return [np.array(channel_data, dtype=float) for channel_data in ch_v2mat]
 
-    # find two-body matrix elements
+    # pack the channel blocks into v2flat, channel c occupies v2flat[v2offsets[c] : v2offsets[c] + v2sizes[c]**2]
+    def init_v2flat(self, ch_v2mat: List[np.ndarray]):
+        self.v2sizes = np.array([len(block) for block in ch_v2mat], dtype=np.int64)
+        self.v2offsets = np.concatenate(([0], np.cumsum(self.v2sizes**2)[:-1])).astype(np.int64)
+        self.v2flat = np.concatenate([block.ravel() for block in ch_v2mat]) if ch_v2mat else np.zeros(0)
+        self.ch_v2mat = [self.v2flat[offset : offset + size * size].reshape(size, size) for offset, size in zip(self.v2offsets.tolist(), self.v2sizes.tolist())]
+
+    def init_pair_index(self):
+        self.pair_channel = np.full((self.NMO, self.NMO), -1, dtype=np.int64)
+        self.pair_position = np.zeros((self.NMO, self.NMO), dtype=np.int64)
+        self.pair_sign = np.zeros((self.NMO, self.NMO))
+        for channel_index in range(self.basis.two_body_channel_number):
+            for channel_position, (a, b) in enumerate(self.basis.two_body_basis_channel[channel_index]):
+                self.pair_channel[a, b] = self.pair_channel[b, a] = channel_index
+                self.pair_position[a, b] = self.pair_position[b, a] = channel_position
+                self.pair_sign[a, b] = 1.0
+                self.pair_sign[b, a] = -1.0
+
+    # diagonal two-body matrix elements v_{klkl} as a symmetric (NMO, NMO) matrix, zero for k == l
+    def init_v2diag(self) -> np.ndarray:
+        v2diag = np.zeros((self.NMO, self.NMO))
+        for k in range(self.NMO):
+            for l in range(k + 1, self.NMO):
+                v2diag[k, l] = v2diag[l, k] = self.find_v2mat(k, l, k, l)
+        return v2diag
+
+    # find two-body matrix elements, v_{bacd} = -v_{abcd}
     def find_v2mat(self, a: int, b: int, c: int, d: int) -> float:
-        channel_index_ab = self.basis.get_two_body_channel_index(a, b)
-        channel_index_cd = self.basis.get_two_body_channel_index(c, d)
-        channel_position_ab = self.basis.get_two_body_channel_position(a, b)
-        channel_position_cd = self.basis.get_two_body_channel_position(c, d)
-        if channel_index_ab != channel_index_cd:  # in FCI this will happen
+        channel_index_ab = self.pair_channel[a, b]
+        channel_index_cd = self.pair_channel[c, d]
+        if channel_index_ab != channel_index_cd or channel_index_ab < 0:  # in FCI this will happen
             return 0.0
-        return self.ch_v2mat[channel_index_ab][channel_position_ab][channel_position_cd]
+        index = self.v2offsets[channel_index_ab] + self.pair_position[a, b] * self.v2sizes[channel_index_ab] + self.pair_position[c, d]
+        return float(self.pair_sign[a, b] * self.pair_sign[c, d] * self.v2flat[index])
+
+    # find_v2mat for index arrays (broadcast against each other), one gather from v2flat
+    def find_v2mat_batch(self, a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+        channel_index_ab = self.pair_channel[a, b]
+        channel_index_cd = self.pair_channel[c, d]
+        valid = (channel_index_ab == channel_index_cd) & (channel_index_ab >= 0)
+        channel = np.where(valid, channel_index_ab, 0)
+        index = self.v2offsets[channel] + self.pair_position[a, b] * self.v2sizes[channel] + self.pair_position[c, d]
+        index = np.where(valid, index, 0)
+        return np.where(valid, self.pair_sign[a, b] * self.pair_sign[c, d] * self.v2flat[index], 0.0)
+
+    # cache Hmat0, Hmat1, Hmat2 and Hmat on raw bitstrings; the cal_* methods always compute from scratch
+    # only these scalar lookups use the cache (FCI matrix build, MBPT, D0 and its connections, core spaces and
+    # SpectralBounds); FCIQMC spawning goes through the vectorized *_batch methods, which gather from the flat
+    # integral store and bypass it
+    def enable_cache(self, capacity: int, policy: str = "lru"):
+        self.cache = MatrixElementCache(capacity, policy)
+
+    def disable_cache(self):
+        self.cache = None
 
     def Hmat0(self, D: Det) -> float:
-        vsum = self.v0mat
-        for k in range(self.NMO):
-            if D.is_occupied(k):
-                vsum += self.ch_v1mat[k]  # 1-body contribution h_{k}
-                for l in range(k + 1, self.NMO):
-                    if D.is_occupied(l):
-                        vsum += self.find_v2mat(k, l, k, l)  # 2-body contribution v_{klkl}
-        return vsum
+        if self.cache is None:
+            return self.cal_Hmat0(D)
+        key = (D.bits,)
+        value = self.cache.get(key)
+        if value is None:
+            value = self.cal_Hmat0(D)
+            self.cache.put(key, value)
+        return value
 
     def Hmat1(self, D: Det, a: int, b: int) -> float:
-        if b > a:
-            a, b = b, a
-        Dbits = D.bits
-        bits_permute = (Dbits >> (b + 1)) << (self.NMO - a + b + 1)
-        Dpermute = Det.from_int(bits_permute, self.NMO)
-        permute = Dpermute.count_occupation()
-        vsum = 0.0
-        for k in range(self.NMO):
-            if D.is_occupied(k):
-                vsum += self.find_v2mat(b, k, a, k)  # 2-body contribution v_{bkak}
-        return iphase_double(permute) * vsum
+        if self.cache is None:
+            return self.cal_Hmat1(D, a, b)
+        key = (D.bits, a, b)
+        value = self.cache.get(key)
+        if value is None:
+            value = self.cal_Hmat1(D, a, b)
+            self.cache.put(key, value)
+        return value
 
     def Hmat2(self, D: Det, a: int, b: int, c: int, d: int) -> float:
-        Dbits = D.bits
-        bits_permute_ab = (Dbits >> (a + 1)) << (self.NMO - b + a + 1)  # permute(a,b)
-        bits_permute_cd = (Dbits >> (c + 1)) << (self.NMO - d + c + 1)  # permute(c,d)
-        bits_permute = bits_permute_ab + bits_permute_cd
-        Dpermute = Det.from_int(bits_permute, self.NMO)
-        permute = Dpermute.count_occupation()
-        return iphase_double(permute) * self.find_v2mat(c, d, a, b)  # 2-body contribution v_{cdab}
+        if self.cache is None:
+            return self.cal_Hmat2(D, a, b, c, d)
+        key = (D.bits, a, b, c, d)
+        value = self.cache.get(key)
+        if value is None:
+            value = self.cal_Hmat2(D, a, b, c, d)
+            self.cache.put(key, value)
+        return value
+
+    # diagonal energies after single excitations a -> b of D, updated from Hii = <D|H|D>
+    # only the one-body and two-body terms touched by the excitation change
+    def Hmat0_single_batch(self, Hii: float, D: Det, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        h = self.ch_v1mat
+        v = self.v2diag
+        vocc = v[:, occupied_indices(D.bits)].sum(axis=1)  # sum_{k in D} v_{xkxk}
+        return Hii - h[a] + h[b] - vocc[a] + vocc[b] - v[a, b]
+
+    # diagonal energies after double excitations (a, b) -> (c, d) of D, updated from Hii = <D|H|D>
+    def Hmat0_double_batch(self, Hii: float, D: Det, a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+        h = self.ch_v1mat
+        v = self.v2diag
+        vocc = v[:, occupied_indices(D.bits)].sum(axis=1)
+        removed = h[a] + h[b] + vocc[a] + vocc[b] - v[a, b]
+        added = h[c] + h[d] + vocc[c] + vocc[d] - v[c, a] - v[c, b] - v[d, a] - v[d, b] + v[c, d]
+        return Hii - removed + added
 
     # calculate <Df|H|Di>
     def Hmat(self, Df: Det, Di: Det) -> float:
+        if self.cache is None:
+            return self.cal_Hmat(Df, Di)
+        key = (Df.bits, Di.bits)
+        value = self.cache.get(key)
+        if value is None:
+            value = self.cal_Hmat(Df, Di)
+            self.cache.put(key, value)
+        return value
+
+    def cal_Hmat0(self, D: Det) -> float:
+        occ = occupied_indices(D.bits)
+        # 1-body contribution h_{k}, 2-body contribution v_{klkl} (k < l)
+        return self.v0mat + float(self.ch_v1mat[occ].sum()) + 0.5 * float(self.v2diag[np.ix_(occ, occ)].sum())
+
+    # the phase counts the occupied orbitals of D strictly between the orbitals of each moved pair
+    def cal_Hmat1(self, D: Det, a: int, b: int) -> float:
+        permute = count_between(D.bits, a, b)
+        occ = occupied_indices(D.bits)
+        vsum = float(self.find_v2mat_batch(b, occ, a, occ).sum())  # 2-body contribution v_{bkak}
+        return iphase_double(permute) * vsum
+
+    def cal_Hmat2(self, D: Det, a: int, b: int, c: int, d: int) -> float:
+        Dbits = D.bits
+        permute = count_between(Dbits, a, b) + count_between(Dbits, c, d)
+        return iphase_double(permute) * self.find_v2mat(c, d, a, b)  # 2-body contribution v_{cdab}
+
+    # Hmat1 for a batch of single excitations a -> b of D, D still holding a
+    def Hmat1_batch(self, D: Det, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        if len(a) == 0:
+            return np.zeros(0)
+        permute = DetArray.from_ints([D.bits], self.NMO).flip(a).count_between(a, b)
+        occ = occupied_indices(D.bits)
+        # v_{bkak} for all occupied k != a, one gather of shape (len(a), len(occ))
+        vsum = (self.find_v2mat_batch(b[:, None], occ[None, :], a[:, None], occ[None, :]) * (occ[None, :] != a[:, None])).sum(axis=1)
+        return np.where(permute % 2 == 0, 1.0, -1.0) * vsum
+
+    # Hmat2 for a batch of double excitations (a, b) -> (c, d) of D, D still holding a and b
+    def Hmat2_batch(self, D: Det, a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+        if len(a) == 0:
+            return np.zeros(0)
+        Dr = DetArray.from_ints([D.bits], self.NMO).flip(a).flip(b)
+        permute = Dr.count_between(a, b) + Dr.count_between(c, d)
+        return np.where(permute % 2 == 0, 1.0, -1.0) * self.find_v2mat_batch(c, d, a, b)
+
+    def cal_Hmat(self, Df: Det, Di: Det) -> float:
         Ddiff = Df ^ Di
         diff = Ddiff.count_occupation()  # number of different orbitals of Df and Di
         Dsame = Df & Di
         if diff == 0:
             # diagonal part
             # <D|H|D>, with Df=Di=D
-            return self.Hmat0(Dsame)
+            return self.cal_Hmat0(Dsame)
         elif diff == 2:
             # single-excitation part
             ai = (Ddiff & Di).get_occupied_indices()[0]
             af = (Ddiff & Df).get_occupied_indices()[0]
             if not check_one_body_symmetry(self.basis.get_orbit(ai), self.basis.get_orbit(af)):
                 return 0.0
-            return self.Hmat1(Dsame, ai, af)
+            return self.cal_Hmat1(Dsame, ai, af)
         elif diff == 4:
             # double-excitation part
             i1, i2 = (Ddiff & Di).get_occupied_indices()
             f1, f2 = (Ddiff & Df).get_occupied_indices()
             if not check_two_body_symmetry(self.basis.get_orbit(i1), self.basis.get_orbit(i2), self.basis.get_orbit(f1), self.basis.get_orbit(f2)):
                 return 0.0
-            return self.Hmat2(Dsame, i1, i2, f1, f2)
+            return self.cal_Hmat2(Dsame, i1, i2, f1, f2)
         else:
             # cannot happen
             return 0
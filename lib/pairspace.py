@@ -0,0 +1,92 @@
+from .basis import *
+
+
+# seniority-zero pair space of the pairing model
+# bit p of a pair determinant is set when level p (both spin orbitals 2p, 2p+1) is doubly occupied
+class PairBasis:
+    # a pair hop is the only move in pair space, the uniform generator never proposes double excitations
+    onebody_probability: float = 1.0
+
+    def __init__(self, p_max: int, delta: float = 1, n: int = 4):
+        if n % 2 != 0:
+            raise ValueError(f"error: pair space needs an even particle number, got n = {n}")
+        self.p_max: int = p_max
+        self.delta: float = delta
+        self.sp_orbits: List[Orbital] = build_sp_orbits(p_max, delta)
+        self.NMO: int = p_max  # number of pair levels
+        self.particle_number: int = n // 2  # number of pairs
+        # energy of a pair on level p: e_{p,+} + e_{p,-}
+        self.pair_energies: np.ndarray = np.array([self.sp_orbits[2 * p].e + self.sp_orbits[2 * p + 1].e for p in range(p_max)])
+        self.levels_mask: int = (1 << p_max) - 1
+
+    # n: number of particles, filling the n/2 lowest pair levels
+    def minimum_det(self, n: int) -> Det:
+        if n % 2 != 0 or n // 2 > self.NMO:
+            raise ValueError("error in minimum_det...")
+        return Det(range(n // 2), self.NMO)
+
+    # bitstrings of all pair hops of bits
+    def connected_dets(self, bits: int) -> List[int]:
+        free = occupied_indices(self.levels_mask & ~bits).tolist()
+        return [bits ^ (1 << a) ^ (1 << b) for a in occupied_indices(bits).tolist() for b in free]
+
+    # count pair hops a -> b of bits at once; failed attempts have invp = 0
+    def single_excite_batch(self, bits: int, count: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        occ = occupied_indices(bits)
+        free = occupied_indices(self.levels_mask & ~bits)
+        if count == 0 or len(free) == 0:
+            return (np.zeros(count, dtype=np.int64), np.zeros(count, dtype=np.int64), np.zeros(count, dtype=np.int64))
+        a = occ[rng.integers(0, len(occ), size=count)]
+        b = free[rng.integers(0, len(free), size=count)]
+        invp = np.full(count, len(occ) * len(free), dtype=np.int64)
+        return (a, b, invp)
+
+    # pairs never move two at a time
+    def double_excite_batch(self, bits: int, count: int, rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        empty = np.zeros(count, dtype=np.int64)
+        return (empty, empty, empty, empty, empty)
+
+
+# pairing Hamiltonian in pair space, H = sum_p (e_{p,+} + e_{p,-}) N_p - g/2 sum_{pq} P+_p P_q
+# no phases: pair operators on different levels commute
+class PairHamiltonian:
+    def __init__(self, basis: PairBasis, g: float = 0.1):
+        self.basis: PairBasis = basis
+        self.NMO: int = basis.NMO
+        self.g: float = g
+
+    def Hmat0(self, D: Det) -> float:
+        vsum = 0.0
+        for p in D.get_occupied_indices():
+            vsum += self.basis.pair_energies[p] - self.g / 2.0
+        return vsum
+
+    # pair hop a -> b; D has level a already emptied, as in Hamiltonian.Hmat1
+    def Hmat1(self, D: Det, a: int, b: int) -> float:
+        return -self.g / 2.0
+
+    def Hmat2(self, D: Det, a: int, b: int, c: int, d: int) -> float:
+        return 0.0
+
+    def Hmat1_batch(self, D: Det, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return np.full(len(a), -self.g / 2.0)
+
+    def Hmat2_batch(self, D: Det, a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+        return np.zeros(len(a))
+
+    # diagonal energies after pair hops a -> b of D, updated from Hii = <D|H|D>
+    def Hmat0_single_batch(self, Hii: float, D: Det, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        return Hii - self.basis.pair_energies[a] + self.basis.pair_energies[b]
+
+    def Hmat0_double_batch(self, Hii: float, D: Det, a: np.ndarray, b: np.ndarray, c: np.ndarray, d: np.ndarray) -> np.ndarray:
+        return np.full(len(a), Hii)
+
+    # calculate <Df|H|Di>
+    def Hmat(self, Df: Det, Di: Det) -> float:
+        diff = (Df ^ Di).count_occupation()
+        if diff == 0:
+            return self.Hmat0(Df)
+        elif diff == 2:
+            return -self.g / 2.0
+        else:
+            return 0.0
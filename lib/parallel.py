@@ -0,0 +1,291 @@
+import os
+import atexit
+import sys
+import queue
+import threading
+import multiprocessing as mp
+from abc import ABC, abstractmethod
+from multiprocessing import shared_memory
+
+from .fciqmc import *
+
+
+# one result from every process through results, in arrival order
+# a process that exits without delivering its result (killed by a signal or the OOM killer, or failed before it
+# could report) raises RuntimeError instead of leaving the caller waiting forever
+def gather_results(processes: List[mp.Process], results, poll: float = 1.0) -> list:
+    outcome = []
+    while len(outcome) < len(processes):
+        try:
+            outcome.append(results.get(timeout=poll))
+            continue
+        except queue.Empty:
+            pass
+        exitcodes = [process.exitcode for process in processes]
+        if all(code is None for code in exitcodes):
+            continue
+        # a process that just exited may still have its result in the pipe
+        try:
+            outcome.append(results.get(timeout=poll))
+            continue
+        except queue.Empty:
+            pass
+        if any(code not in (None, 0) for code in exitcodes) or sum(code is not None for code in exitcodes) > len(outcome):
+            raise RuntimeError(f"error: a process exited without delivering its result, exit codes {exitcodes}")
+    return outcome
+
+
+# FCIQMC on a partition of the determinants: determinant D is owned by rank DetArray.hash(D) % processes
+# each rank runs the serial step and annihilation on its own determinants; subclasses deliver spawns to their
+# owners (exchange) and sum the estimators over all ranks (allreduce_estimators), which is done whenever the
+# estimators are read, so all ranks take identical shift updates and loop decisions
+# rank is None outside of the ranks, where the serial estimators are used
+class PartitionedFCIQMC(FCIQMC, ABC):
+    def __init__(self, basis: Basis, hamil: Hamiltonian, params: dict, n: int, processes: int, rank: Optional[int] = None):
+        if params.get("core_space") is not None:
+            raise ValueError("error: the semi-stochastic core space is only available in the serial FCIQMC")
+        # the ranks would see different clocks and leave the loop at different steps
+        if params.get("time_limit") is not None:
+            raise ValueError("error: time_limit is only available in the serial FCIQMC, use target_error")
+        # every rank sees only its own spawns and would pick a different d_tau
+        if params.get("d_tau_control"):
+            raise ValueError("error: d_tau_control is only available in the serial FCIQMC")
+        # every rank holds only its slice of the walkers, one shared checkpoint file would lose the others
+        if params.get("checkpoint_file") is not None:
+            raise ValueError("error: checkpoints are only available in the serial FCIQMC")
+        self.processes: int = processes
+        self.rank: Optional[int] = rank
+        self.seed_sequence: np.random.SeedSequence = np.random.SeedSequence(params.get("seed"))
+        super().__init__(basis, hamil, params, n)
+        if rank is not None:
+            self.rng = self.rank_rng(rank)
+
+    # owning rank of (n, K) determinant words
+    def owner(self, words: np.ndarray) -> np.ndarray:
+        return (DetArray(words, self.NMO).hash() % np.uint64(self.processes)).astype(np.int64)
+
+    def owns_D0(self) -> bool:
+        return self.rank == int(self.owner(int_to_words(self.D0.bits, word_number(self.NMO))[None, :])[0])
+
+    # independent random stream of a rank, all derived from params["seed"]
+    def rank_rng(self, rank: int) -> np.random.Generator:
+        return np.random.default_rng(self.seed_sequence.spawn(self.processes)[rank])
+
+    # sum (sum_i Ni H_0i, sum_i |Ni|, N0, occupied determinants) over all ranks, in rank order
+    @abstractmethod
+    def allreduce_estimators(self) -> Tuple[float, float, float, float]:
+        pass
+
+    # local (sum_i Ni H_0i, sum_i |Ni|, N0, occupied determinants) of this rank
+    def local_estimators(self) -> Tuple[float, float, float, float]:
+        N0 = 0.0
+        if self.owns_D0():
+            slot = self.walkers.find(self.D0.bits)
+            N0 = float(self.walkers.pops[slot]) if slot >= 0 else 0.0
+        return (self.energy_numerator, self.total_number, N0, float(len(self.walkers)))
+
+    # move every spawn in new_walkers to the rank owning its target
+    @abstractmethod
+    def exchange(self):
+        pass
+
+    def get_number(self) -> float:
+        if self.rank is None:
+            return super().get_number()
+        return self.allreduce_estimators()[1]
+
+    def get_reference_number(self) -> float:
+        if self.rank is None:
+            return super().get_reference_number()
+        N0 = self.allreduce_estimators()[2]
+        if N0 == 0.0:
+            raise ValueError("error: number of walkers on D0 is 0")
+        return N0
+
+    def get_energy(self) -> float:
+        return self.get_energy_and_number()[0]
+
+    def get_energy_and_number(self) -> Tuple[float, float]:
+        numerator, N0, number, _ = self.get_estimators()
+        return (numerator / N0, number)
+
+    def get_estimators(self) -> Tuple[float, float, float, int]:
+        if self.rank is None:
+            return super().get_estimators()
+        numerator, number, N0, dets = self.allreduce_estimators()
+        if N0 == 0.0:
+            raise ValueError("error: number of walkers on D0 is 0")
+        return (numerator, N0, number, int(dets))
+
+    # D0 lives on its owner only
+    def reset_walkers(self):
+        super().reset_walkers()
+        if self.rank is not None and not self.owns_D0():
+            self.walkers.clear()
+            self.refresh_estimators()
+
+    def save_checkpoint(self, path: Optional[str] = None, background: bool = True):
+        raise ValueError("error: checkpoints are only available in the serial FCIQMC")
+
+    def load_checkpoint(self, path: str):
+        raise ValueError("error: checkpoints are only available in the serial FCIQMC")
+
+    # walker evolution step; spawns are delivered to their owners before annihilation
+    def step(self):
+        super().step()
+        if self.rank is not None:
+            self.exchange()
+
+
+# multi-process FCIQMC on one node: the ranks are forked workers, spawns travel to their owner through
+# shared-memory mailboxes and the estimators are all-reduced through shared rows
+# workers are forked on the first warm-up call and finish when start returns
+class ParallelFCIQMC(PartitionedFCIQMC):
+    # mailbox_capacity: spawn records per (source, destination) pair and exchange round
+    def __init__(self, basis: Basis, hamil: Hamiltonian, params: dict, n: int, processes: int = None, mailbox_capacity: int = 4096):
+        super().__init__(basis, hamil, params, n, processes if processes is not None else os.cpu_count())
+        self.mailbox_capacity: int = mailbox_capacity
+        self.workers: List[mp.Process] = []
+        self.connections: list = []
+        self.segments: List[shared_memory.SharedMemory] = []
+
+    # shared mailboxes (source, destination, record), record counts, pending flags, all-reduce rows and the barrier
+    def allocate_shared(self, context):
+        P = self.processes
+        record_dtype = self.new_walkers.dtype
+        mailbox = shared_memory.SharedMemory(create=True, size=max(1, P * P * self.mailbox_capacity * record_dtype.itemsize))
+        control = shared_memory.SharedMemory(create=True, size=8 * (P * P + P + 2 * P * 4))
+        self.segments = [mailbox, control]
+        self.mailbox: np.ndarray = np.ndarray((P, P, self.mailbox_capacity), dtype=record_dtype, buffer=mailbox.buf)
+        self.mail_counts: np.ndarray = np.ndarray((P, P), dtype=np.int64, buffer=control.buf)
+        self.mail_pending: np.ndarray = np.ndarray(P, dtype=np.int64, buffer=control.buf, offset=8 * P * P)
+        # two alternating row sets, so a fast worker never overwrites rows another worker is still summing
+        self.reduce_rows: np.ndarray = np.ndarray((2, P, 4), dtype=float, buffer=control.buf, offset=8 * (P * P + P))
+        self.reduce_rows[:] = 0.0
+        self.reduce_parity: int = 0
+        self.barrier = context.Barrier(P)
+
+    def release_shared(self):
+        self.mailbox = self.mail_counts = self.mail_pending = self.reduce_rows = None
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+        self.segments = []
+
+    def allreduce_estimators(self) -> Tuple[float, float, float, float]:
+        rows = self.reduce_rows[self.reduce_parity]
+        rows[self.rank] = self.local_estimators()
+        self.barrier.wait()
+        totals = tuple(float(x) for x in rows.sum(axis=0))
+        self.reduce_parity = 1 - self.reduce_parity
+        return totals
+
+    # send every spawn to the worker owning its target, in rounds of at most mailbox_capacity records per pair
+    def exchange(self):
+        P, rank, capacity = self.processes, self.rank, self.mailbox_capacity
+        records = self.new_walkers.records[: len(self.new_walkers)]
+        owners = self.owner(records["det"])
+        order = np.argsort(owners, kind="stable")
+        outgoing = records[order]
+        bounds = np.searchsorted(owners[order], np.arange(P + 1))
+        self.new_walkers.clear()
+        self.new_walkers.append_records(outgoing[bounds[rank] : bounds[rank + 1]])
+        sent = bounds[:-1].copy()
+        while True:
+            for dst in range(P):
+                if dst == rank:
+                    continue
+                m = min(bounds[dst + 1] - sent[dst], capacity)
+                self.mailbox[rank, dst, :m] = outgoing[sent[dst] : sent[dst] + m]
+                self.mail_counts[rank, dst] = m
+                sent[dst] += m
+            self.mail_pending[rank] = int(np.any((sent < bounds[1:]) & (np.arange(P) != rank)))
+            self.barrier.wait()
+            for src in range(P):
+                if src != rank:
+                    self.new_walkers.append_records(self.mailbox[src, rank, : self.mail_counts[src, rank]])
+            pending = bool(self.mail_pending.any())
+            # nobody writes the mailboxes again before everyone has read them
+            self.barrier.wait()
+            if not pending:
+                break
+
+    # worker main loop, runs the commands sent by the parent
+    def serve(self, rank: int, connection):
+        self.rank = rank
+        self.rng = self.rank_rng(rank)
+        self.reset_walkers()
+        # worker 0 keeps the trace, the others sample the same values and only hold them in memory
+        if rank != 0:
+            sys.stdout = open(os.devnull, "w")
+            self.trace = TraceSink()
+        while True:
+            command = connection.recv()
+            if command == "stop":
+                break
+            try:
+                getattr(FCIQMC, command)(self)
+                self.trace.flush()
+                columns = self.trace.columns() if self.trace.path is None else None
+                connection.send((columns, self.reblock, self.S, self.d_tau, self.stop_reason))
+            except BaseException as error:
+                # wake up the workers waiting for this one
+                self.barrier.abort()
+                connection.send(error)
+                break
+
+    def launch(self):
+        if self.workers:
+            return
+        context = mp.get_context("fork")
+        self.allocate_shared(context)
+        # a script that stops after warm up still releases the workers and shared memory
+        atexit.register(self.close)
+        for rank in range(self.processes):
+            parent_end, child_end = context.Pipe()
+            worker = context.Process(target=self.serve, args=(rank, child_end), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+            self.connections.append(parent_end)
+
+    # run a FCIQMC method in every worker and take the trace, reblocking and shift of worker 0
+    def run(self, command: str):
+        self.launch()
+        for connection in self.connections:
+            connection.send(command)
+        results = [connection.recv() for connection in self.connections]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            self.close()
+            # the other workers only saw the aborted barrier
+            raise next((error for error in errors if not isinstance(error, threading.BrokenBarrierError)), errors[0])
+        columns, self.reblock, self.S, self.d_tau, self.stop_reason = results[0]
+        if columns is None:
+            # worker 0 wrote the trace files
+            self.trace = TraceSink(self.trace.path, self.trace.chunk_rows)
+        else:
+            self.trace.truncate(0)
+            self.trace.extend(columns)
+
+    def close(self):
+        for connection, worker in zip(self.connections, self.workers):
+            try:
+                connection.send("stop")
+            except (BrokenPipeError, OSError):
+                pass
+            worker.join()
+        self.workers = []
+        self.connections = []
+        self.release_shared()
+        atexit.unregister(self.close)
+
+    def warm(self):
+        self.run("warm")
+
+    # the adaptive d_tau needs the spawns of all ranks, run warm_search of a serial FCIQMC to choose d_tau
+    def warm_search(self):
+        raise ValueError("error: warm_search is only available in the serial FCIQMC")
+
+    def start(self):
+        self.run("start")
+        self.close()
@@ -0,0 +1,129 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+# streaming Flyvbjerg-Petersen reblocking of m serially correlated variables
+# level l sees blocks of 2^l consecutive samples; per level only the block count, the sum and the sum of outer
+# products of the block means are kept, plus the block still waiting for its partner, so memory is O(m^2 log n)
+class ReblockAccumulator:
+    def __init__(self, m: int):
+        self.m: int = m
+        self.counts: List[int] = []
+        self.sums: List[np.ndarray] = []
+        self.products: List[np.ndarray] = []
+        self.pending: List[Optional[np.ndarray]] = []
+
+    def __len__(self) -> int:
+        return self.counts[0] if self.counts else 0
+
+    def add(self, values):
+        x = np.asarray(values, dtype=float)
+        level = 0
+        while True:
+            if level == len(self.counts):
+                self.counts.append(0)
+                self.sums.append(np.zeros(self.m))
+                self.products.append(np.zeros((self.m, self.m)))
+                self.pending.append(None)
+            self.counts[level] += 1
+            self.sums[level] += x
+            self.products[level] += np.outer(x, x)
+            if self.pending[level] is None:
+                self.pending[level] = x
+                return
+            x = 0.5 * (self.pending[level] + x)
+            self.pending[level] = None
+            level += 1
+
+    # rows: (n, m) samples in order
+    def extend(self, rows: np.ndarray):
+        for row in np.asarray(rows, dtype=float):
+            self.add(row)
+
+    def clear(self):
+        self.__init__(self.m)
+
+    # mean of every variable over all samples
+    def mean(self) -> np.ndarray:
+        return self.sums[0] / self.counts[0]
+
+    # sample covariance of the block means at level l
+    def covariance(self, level: int) -> np.ndarray:
+        n = self.counts[level]
+        mean = self.sums[level] / n
+        return (self.products[level] / n - np.outer(mean, mean)) * n / (n - 1)
+
+    # levels with at least two blocks
+    def level_number(self) -> int:
+        return sum(1 for n in self.counts if n >= 2)
+
+    # standard error of the mean of variable i at every level
+    def errors(self, i: int) -> np.ndarray:
+        return np.array([np.sqrt(max(self.covariance(level)[i, i], 0.0) / self.counts[level]) for level in range(self.level_number())])
+
+    # standard error of mean(i) / mean(j) at every level, from the block covariance (first-order propagation)
+    def ratio_errors(self, i: int, j: int) -> np.ndarray:
+        mean = self.mean()
+        ratio = mean[i] / mean[j]
+        errors = []
+        for level in range(self.level_number()):
+            cov = self.covariance(level)
+            variance = ratio**2 * (cov[i, i] / mean[i] ** 2 + cov[j, j] / mean[j] ** 2 - 2.0 * cov[i, j] / (mean[i] * mean[j]))
+            errors.append(np.sqrt(max(variance, 0.0) / self.counts[level]))
+        return np.array(errors)
+
+    # statistics from the error at the plateau, chosen with the criterion of Lee et al. (PRE 83, 066706):
+    # the first level with block size B satisfying B^3 > 2 n (error_B / error_0)^4
+    # correlation_time: integrated autocorrelation time in samples, (error_B / error_0)^2 / 2
+    # optimal_level is None (and the largest level is reported) when no level reaches the plateau yet
+    def plateau(self, mean: float, errors: np.ndarray) -> Dict[str, Optional[float]]:
+        if len(errors) == 0:
+            return {"mean": mean, "error": float("nan"), "error_error": float("nan"), "correlation_time": float("nan"), "optimal_level": None}
+        optimal = None
+        for level, error in enumerate(errors):
+            if errors[0] > 0.0 and 2.0 ** (3 * level) > 2.0 * self.counts[0] * (error / errors[0]) ** 4:
+                optimal = level
+                break
+        level = optimal if optimal is not None else len(errors) - 1
+        error = float(errors[level])
+        ratio = error / errors[0] if errors[0] > 0.0 else 1.0
+        return {
+            "mean": mean,
+            "error": error,
+            "error_error": float(error / np.sqrt(2.0 * (self.counts[level] - 1))),
+            "correlation_time": float(0.5 * ratio**2),
+            "optimal_level": optimal,
+        }
+
+    def statistics(self, i: int) -> Dict[str, Optional[float]]:
+        return self.plateau(float(self.mean()[i]), self.errors(i))
+
+    def ratio_statistics(self, i: int, j: int) -> Dict[str, Optional[float]]:
+        mean = self.mean()
+        return self.plateau(float(mean[i] / mean[j]), self.ratio_errors(i, j))
+
+    # plain lists, for checkpoints
+    def get_state(self) -> dict:
+        return {
+            "m": self.m,
+            "counts": list(self.counts),
+            "sums": [s.tolist() for s in self.sums],
+            "products": [p.tolist() for p in self.products],
+            "pending": [None if p is None else p.tolist() for p in self.pending],
+        }
+
+    def set_state(self, state: dict):
+        self.m = state["m"]
+        self.counts = list(state["counts"])
+        self.sums = [np.array(s, dtype=float) for s in state["sums"]]
+        self.products = [np.array(p, dtype=float).reshape(self.m, self.m) for p in state["products"]]
+        self.pending = [None if p is None else np.array(p, dtype=float) for p in state["pending"]]
+
+
+# reblock a finished series, e.g. a column of a trace; data: (n,) or (n, m)
+def reblock(data: np.ndarray) -> ReblockAccumulator:
+    data = np.asarray(data, dtype=float)
+    accumulator = ReblockAccumulator(1 if data.ndim == 1 else data.shape[1])
+    accumulator.extend(data.reshape(len(data), -1))
+    return accumulator
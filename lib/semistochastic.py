@@ -0,0 +1,53 @@
+from .basis import *
+from .hamiltonian import *
+from .walkers import *
+
+
+# deterministic core space of semi-stochastic FCIQMC
+# dets: core determinant words sorted by det_keys; the off-diagonal core Hamiltonian H_ij (i != j) is stored
+# in CSR form (indptr, indices, values) with rows and columns in the order of dets
+class CoreSpace:
+    # basis, hamil: Basis and Hamiltonian (or PairBasis and PairHamiltonian); bits: core determinants
+    def __init__(self, basis: Basis, hamil: Hamiltonian, bits: Iterable[int]):
+        self.NMO: int = basis.NMO
+        words = DetArray.from_ints(sorted(set(bits)), self.NMO).words
+        self.dets: np.ndarray = words[np.argsort(det_keys(words))]
+        self.bits: List[int] = DetArray(self.dets, self.NMO).to_ints()
+        self.bit_set: set = set(self.bits)
+        self.indptr: np.ndarray = np.zeros(len(self.bits) + 1, dtype=np.int64)
+        self.indices: np.ndarray = np.array([], dtype=np.int64)
+        self.values: np.ndarray = np.array([])
+        self.build_hamiltonian(basis, hamil)
+        self.rows: np.ndarray = np.repeat(np.arange(len(self.bits)), np.diff(self.indptr))
+
+    def __len__(self) -> int:
+        return len(self.bits)
+
+    # nonzero H_ij between core determinants, from the determinants connected to each column
+    def build_hamiltonian(self, basis: Basis, hamil: Hamiltonian):
+        position = {bits: i for i, bits in enumerate(self.bits)}
+        rows, columns, values = [], [], []
+        for j, bits in enumerate(self.bits):
+            Dj = Det.from_int(bits, self.NMO)
+            for target in set(basis.connected_dets(bits)):
+                i = position.get(target)
+                if i is None:
+                    continue
+                value = hamil.Hmat(Det.from_int(target, self.NMO), Dj)
+                if value != 0.0:
+                    rows.append(i)
+                    columns.append(j)
+                    values.append(value)
+        rows = np.array(rows, dtype=np.int64)
+        order = np.lexsort((np.array(columns, dtype=np.int64), rows))
+        self.indices = np.array(columns, dtype=np.int64)[order]
+        self.values = np.array(values, dtype=float)[order]
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(self.bits))))).astype(np.int64)
+
+    # off-diagonal core Hamiltonian times the core amplitudes x
+    def multiply(self, x: np.ndarray) -> np.ndarray:
+        return np.bincount(self.rows, weights=self.values * x[self.indices], minlength=len(self.bits))
+
+    # which of the (n, K) determinant words belong to the core space
+    def contains(self, words: np.ndarray) -> np.ndarray:
+        return search_sorted_dets(self.dets, words) >= 0
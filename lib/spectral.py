@@ -0,0 +1,133 @@
+import math
+
+from .pairspace import *
+from .semistochastic import *
+
+
+# spectral range E_max - E_0 of the Hamiltonian in the sector of D0, estimated before any sampling
+# E_max: Gershgorin bound, the largest diagonal Hmat0 found by a greedy climb and random walks from D0 plus a bound
+# on the off-diagonal row sum of every determinant taken from the channel blocks of the two-body interaction
+# E_0: lowest Ritz value of a few Lanczos steps on the lanczos_size determinants closest to D0 (an upper bound)
+# the FCIQMC projector 1 - d_tau (H - S) is stable for d_tau < 2 / (E_max - E_0)
+class SpectralBounds:
+    def __init__(self, basis: Basis, hamil: Hamiltonian, n: int, samples: int = 32, walk_length: int = 8, lanczos_size: int = 256, lanczos_steps: int = 20, seed: Optional[int] = None):
+        self.basis: Basis = basis
+        self.hamiltonian: Hamiltonian = hamil
+        self.NMO: int = basis.NMO
+        self.particle_number: int = n
+        self.samples: int = samples
+        self.walk_length: int = walk_length
+        self.lanczos_size: int = lanczos_size
+        self.lanczos_steps: int = lanczos_steps
+        self.rng: np.random.Generator = np.random.default_rng(seed)
+        self.D0: Det = basis.minimum_det(n)
+        self.min_diag: float = math.inf
+        self.max_diag: float = -math.inf
+        self.radius: float = 0.0
+        self.ritz_values: np.ndarray = np.array([])
+        self.e_min: Optional[float] = None
+        self.e_max: Optional[float] = None
+
+    def diag(self, bits: int) -> float:
+        return self.hamiltonian.Hmat0(Det.from_int(bits, self.NMO))
+
+    # largest off-diagonal row sum sum_{j != i} |H_ij| any determinant can have
+    # two-body channel row (a, b) holds <ab|v|cd> for every pair (c, d) of the channel; every single and double
+    # excitation of D is one such entry in the row of an occupied pair, so the n(n-1)/2 largest off-diagonal row
+    # sums bound the whole row of H (the one-body part is diagonal)
+    def channel_radius(self) -> float:
+        if isinstance(self.hamiltonian, PairHamiltonian):
+            pairs = self.basis.particle_number
+            return abs(self.hamiltonian.g) / 2.0 * pairs * (self.NMO - pairs)
+        rows = [np.abs(block).sum(axis=1) - np.abs(np.diag(block)) for block in self.hamiltonian.ch_v2mat if len(block) > 0]
+        rows = np.sort(np.concatenate(rows))[::-1] if rows else np.zeros(0)
+        return float(rows[: math.comb(self.particle_number, 2)].sum())
+
+    # diagonal energies along a greedy climb to the highest diagonal and along random walks, all from D0
+    def sample_diagonals(self):
+        energies = [self.diag(self.D0.bits)]
+        bits, energy = self.D0.bits, energies[0]
+        while True:
+            candidates = self.basis.connected_dets(bits)
+            values = [self.diag(target) for target in candidates]
+            energies.extend(values)
+            if not values or max(values) <= energy:
+                break
+            best = int(np.argmax(values))
+            bits, energy = candidates[best], values[best]
+        for _ in range(self.samples):
+            bits = self.D0.bits
+            for _ in range(self.walk_length):
+                candidates = self.basis.connected_dets(bits)
+                if not candidates:
+                    break
+                bits = candidates[int(self.rng.integers(len(candidates)))]
+                energies.append(self.diag(bits))
+        self.min_diag = min(energies)
+        self.max_diag = max(energies)
+
+    # lanczos_size determinants reached first by a breadth-first search over connected_dets from D0
+    def lanczos_space(self) -> List[int]:
+        seen = {self.D0.bits}
+        order = [self.D0.bits]
+        head = 0
+        while head < len(order) and len(order) < self.lanczos_size:
+            for bits in self.basis.connected_dets(order[head]):
+                if bits not in seen and len(order) < self.lanczos_size:
+                    seen.add(bits)
+                    order.append(bits)
+            head += 1
+        return order
+
+    # Ritz values of lanczos_steps Lanczos steps from D0 in the BFS subspace, with full reorthogonalization
+    def lanczos(self) -> np.ndarray:
+        space = CoreSpace(self.basis, self.hamiltonian, self.lanczos_space())
+        diagonal = np.array([self.diag(bits) for bits in space.bits])
+        vectors = [np.zeros(len(space))]
+        vectors[0][space.bits.index(self.D0.bits)] = 1.0
+        alphas, betas = [], []
+        for _ in range(min(self.lanczos_steps, len(space))):
+            v = vectors[-1]
+            w = diagonal * v + space.multiply(v)
+            alphas.append(float(np.dot(w, v)))
+            for u in vectors:
+                w -= np.dot(w, u) * u
+            beta = float(np.linalg.norm(w))
+            if beta < 1e-10:
+                break
+            betas.append(beta)
+            vectors.append(w / beta)
+        T = np.diag(alphas) + np.diag(betas[: len(alphas) - 1], 1) + np.diag(betas[: len(alphas) - 1], -1)
+        return np.linalg.eigvalsh(T)
+
+    def analyze(self):
+        self.sample_diagonals()
+        self.radius = self.channel_radius()
+        self.e_max = self.max_diag + self.radius
+        if self.lanczos_steps > 0:
+            self.ritz_values = self.lanczos()
+            self.e_min = float(self.ritz_values[0])
+            self.e_max = max(self.e_max, float(self.ritz_values[-1]))
+        else:
+            self.e_min = self.min_diag - self.radius
+
+    # largest stable d_tau, 2 / (E_max - E_0)
+    def critical_d_tau(self) -> float:
+        if self.e_max is None:
+            self.analyze()
+        return 2.0 / (self.e_max - self.e_min)
+
+    # safety 0.5 also keeps the diagonal death step d_tau (Hii - E_0) below 1, so no walker changes sign by dying
+    def suggest_d_tau(self, safety: float = 0.5) -> float:
+        return safety * self.critical_d_tau()
+
+    # a parent walker moves up to d_tau * radius walkers per step; the threshold stays above that, so one spawn event
+    # cannot make an initiator, and at least 3 (the usual choice)
+    def suggest_initiator_threshold(self, d_tau: float) -> int:
+        if self.e_max is None:
+            self.analyze()
+        return max(3, math.ceil(d_tau * self.radius))
+
+    def print_bounds(self):
+        print(f"diagonal range: [{self.min_diag:.6f}, {self.max_diag:.6f}], off-diagonal radius: {self.radius:.6f}")
+        print(f"E_0 ~ {self.e_min:.6f}, E_max <= {self.e_max:.6f}, critical d_tau: {self.critical_d_tau():.3e}")
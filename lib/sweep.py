@@ -0,0 +1,163 @@
+import os
+import sys
+import multiprocessing as mp
+
+from .pairspace import *
+from .fci import *
+from .ccd import *
+from .mbpt import *
+from .fciqmc import *
+from .parallel import *
+
+
+# solvers of one point of a Sweep: solve(g, state) returns (result, state), where state is what the next point of
+# the same chunk continues from (None at the first point of a chunk)
+
+
+# FCI ground-state energy; the pairing Hamiltonian is H0 + g W, so H0 and W are built once per process and every
+# point only runs Davidson, started from the ground state of the previous point
+# the start vector gets a small random admixture: Davidson keeps the symmetry of its start vector and would
+# otherwise follow the previous ground state through a level crossing with a state of another seniority
+# a point where Davidson does not converge is retried from the lowest diagonal configuration, and gives None (and
+# hands on nothing) when that fails too, so an unconverged vector is never continued from
+class FCISolver:
+    # n: number of occupied orbitals of a configuration, as in FCI (pairs for a PairBasis)
+    def __init__(self, basis: Basis, n: int, hamiltonian_class=Hamiltonian):
+        self.basis: Basis = basis
+        self.particle_number: int = n
+        self.hamiltonian_class = hamiltonian_class
+        self.fci: Optional[FCI] = None
+        self.H0: np.ndarray = np.array([])
+        self.W: np.ndarray = np.array([])
+        self.rng: np.random.Generator = np.random.default_rng(0)
+
+    def build(self):
+        matrices = []
+        for g in (0.0, 1.0):
+            self.fci = FCI(self.basis, self.hamiltonian_class(self.basis, g), self.particle_number)
+            self.fci.build_configurations()
+            self.fci.build_hamiltonian_matrix()
+            matrices.append(self.fci.hamil_matrix)
+        self.H0 = matrices[0]
+        self.W = matrices[1] - matrices[0]
+
+    def solve(self, g: float, state: Optional[np.ndarray]) -> Tuple[Optional[float], Optional[np.ndarray]]:
+        if self.fci is None:
+            self.build()
+        self.fci.hamil_matrix = self.H0 + g * self.W
+        if state is not None:
+            noise = self.rng.standard_normal(len(state))
+            state = state + 1e-3 * noise / np.linalg.norm(noise)
+        if not self.fci.solve_davidson(state) and (state is None or not self.fci.solve_davidson()):
+            return (None, None)
+        return (self.fci.emin, self.fci.ground_state)
+
+
+# CCD correlation energy (None when CCD does not converge), started from the t2 amplitudes of the previous point;
+# a point that diverged hands on nothing, so the next one starts from MBPT2 again
+# ccd_class: CCD, or PairCCD for large p_max (basis may then be a PairBasis)
+class CCDSolver:
+    def __init__(self, basis: Basis, ccd_class=CCD):
+        self.ccd: CCD = ccd_class(basis)
+
+    def solve(self, g: float, state: Optional[np.ndarray]) -> Tuple[Optional[float], Optional[np.ndarray]]:
+        self.ccd.t2 = None
+        energy = self.ccd.get_ccd(g, state)
+        if energy is None or not np.all(np.isfinite(self.ccd.t2)):
+            return (energy, None)
+        return (energy, self.ccd.t2)
+
+
+# MBPT(2) and MBPT(3) correlation energies; nothing to continue from
+class MBPTSolver:
+    def __init__(self, basis: Basis):
+        self.basis: Basis = basis
+
+    def solve(self, g: float, state: None) -> Tuple[Tuple[float, float], None]:
+        mbpt = MBPT(self.basis, Hamiltonian(self.basis, g))
+        return ((mbpt.cal_coor2(g), mbpt.cal_coor3(g)), None)
+
+
+# FCIQMC energy and reblocked error; a point starts from the walkers and shift the previous point ended with,
+# so its warm up is skipped and the shift is already close to the new energy
+class FCIQMCSolver:
+    def __init__(self, basis: Basis, n: int, params: dict, hamiltonian_class=Hamiltonian):
+        self.basis: Basis = basis
+        self.particle_number: int = n
+        self.params: dict = params
+        self.hamiltonian_class = hamiltonian_class
+
+    def solve(self, g: float, state: Optional[Tuple[np.ndarray, np.ndarray, float]]) -> Tuple[Tuple[float, float], Tuple[np.ndarray, np.ndarray, float]]:
+        engine = FCIQMC(self.basis, self.hamiltonian_class(self.basis, g), self.params, self.particle_number)
+        if state is not None:
+            engine.seed_walkers(*state)
+        engine.warm()
+        engine.start()
+        E = engine.get_reblock_statistics()["E"]
+        walkers = engine.walkers
+        return ((E["mean"], E["error"]), (walkers.get_dets().copy(), walkers.get_pops().copy(), engine.S))
+
+
+# scan of the pairing strength g with continuation between neighbouring points
+# g_list is cut into processes contiguous chunks; each chunk is solved point by point by one forked process, from
+# its point nearest to g = 0 (where the reference is exact) outwards in both directions, and every point continues
+# from the state of its neighbour; the basis and the solver reach the processes through fork, nothing is rebuilt
+# per point; a process that dies (e.g. killed by the OOM killer) makes run raise instead of wait
+class Sweep:
+    # quiet: drop the output of the forked processes
+    def __init__(self, g_list: Iterable[float], processes: Optional[int] = None, quiet: bool = True):
+        self.g_list: np.ndarray = np.array(list(g_list), dtype=float)
+        self.processes: int = processes if processes is not None else os.cpu_count()
+        self.quiet: bool = quiet
+
+    # index arrays of the chunks
+    def chunks(self) -> List[np.ndarray]:
+        return [chunk for chunk in np.array_split(np.arange(len(self.g_list)), min(self.processes, len(self.g_list))) if len(chunk) > 0]
+
+    def solve_chunk(self, solver, chunk: np.ndarray) -> Dict[int, object]:
+        pivot = int(np.argmin(np.abs(self.g_list[chunk])))
+        results = {}
+        pivot_state = None
+        for leg in (chunk[pivot:], chunk[:pivot][::-1]):
+            state = pivot_state
+            for i in leg.tolist():
+                results[i], state = solver.solve(float(self.g_list[i]), state)
+                if i == chunk[pivot]:
+                    pivot_state = state
+        return results
+
+    def serve(self, solver, chunk: np.ndarray, queue):
+        if self.quiet:
+            sys.stdout = open(os.devnull, "w")
+        try:
+            queue.put(self.solve_chunk(solver, chunk))
+        except BaseException as error:
+            queue.put(error)
+
+    # result of solver at every g, in the order of g_list
+    def run(self, solver) -> list:
+        chunks = self.chunks()
+        if len(chunks) == 1:
+            results = self.solve_chunk(solver, chunks[0])
+            return [results[i] for i in range(len(self.g_list))]
+        context = mp.get_context("fork")
+        queue = context.Queue()
+        workers = [context.Process(target=self.serve, args=(solver, chunk, queue)) for chunk in chunks]
+        for worker in workers:
+            worker.start()
+        try:
+            outcome = gather_results(workers, queue)
+        except BaseException:
+            for worker in workers:
+                worker.kill()
+            raise
+        finally:
+            for worker in workers:
+                worker.join()
+        errors = [result for result in outcome if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+        results = {}
+        for chunk_results in outcome:
+            results.update(chunk_results)
+        return [results[i] for i in range(len(self.g_list))]
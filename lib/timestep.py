@@ -0,0 +1,72 @@
+from typing import Optional
+
+import numpy as np
+
+
+# adaptive d_tau from the spawn rates |H_ji| / p_gen(j|i), i.e. walkers spawned per parent walker and unit d_tau
+# the rates are counted in a log2 histogram with resolution bins per octave (2^-64 .. 2^64, the outer bins catch
+# the rest); they depend on the Hamiltonian and the excitation generator but not on d_tau, so the counts are kept
+# over the whole run and stay valid when d_tau changes
+# d_tau is chosen so that the percentile spawn stays below bloom_limit walkers and the largest spawn seen stays
+# below bloom_max walkers; it grows by at most a factor growth per adjustment and never exceeds d_tau_max
+# the spawn rates say nothing about the diagonal step 1 - d_tau (Hii - S), which must stay positive: d_tau is also
+# kept at or below death_limit / (max Hii - S), or the walkers on high-energy determinants change sign and the
+# population explodes on bases with a wide diagonal range
+class TimeStepController:
+    def __init__(self, bloom_limit: float = 1.0, percentile: float = 99.0, bloom_max: float = 10.0, d_tau_max: Optional[float] = None, growth: float = 2.0, resolution: int = 8, death_limit: float = 0.5):
+        self.bloom_limit: float = bloom_limit
+        self.percentile: float = percentile
+        self.bloom_max: float = bloom_max
+        self.d_tau_max: Optional[float] = d_tau_max
+        self.death_limit: float = death_limit
+        self.growth: float = growth
+        self.resolution: int = resolution
+        self.offset: int = 64 * resolution + 1
+        self.counts: np.ndarray = np.zeros(2 * self.offset + 1, dtype=np.int64)
+        self.max_rate: float = 0.0
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    # rates: spawn amplitudes divided by d_tau, of either sign
+    def record(self, rates: np.ndarray):
+        rates = np.abs(rates)
+        rates = rates[rates > 0.0]
+        if len(rates) == 0:
+            return
+        bins = np.clip(np.floor(np.log2(rates) * self.resolution).astype(np.int64) + self.offset, 0, len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self.max_rate = max(self.max_rate, float(rates.max()))
+
+    # upper edge of the histogram bin holding the percentile rate (at most max_rate)
+    def percentile_rate(self) -> float:
+        total = self.counts.sum()
+        if total == 0:
+            return 0.0
+        b = int(np.searchsorted(np.cumsum(self.counts), self.percentile / 100.0 * total))
+        return min(2.0 ** ((b - self.offset + 1) / self.resolution), self.max_rate)
+
+    # d_tau to use from now on, given the current one
+    # diagonal_range: max Hii - S over the determinants the walkers can reach, None when unknown
+    def suggest(self, d_tau: float, diagonal_range: Optional[float] = None) -> float:
+        if self.max_rate == 0.0:
+            target = d_tau
+        else:
+            target = min(self.bloom_limit / self.percentile_rate(), self.bloom_max / self.max_rate, self.growth * d_tau)
+        if self.d_tau_max is not None:
+            target = min(target, self.d_tau_max)
+        if diagonal_range is not None and diagonal_range > 0.0:
+            target = min(target, self.death_limit / diagonal_range)
+        return target
+
+    def clear(self):
+        self.counts[:] = 0
+        self.max_rate = 0.0
+
+    # plain lists, for checkpoints
+    def get_state(self) -> dict:
+        return {"counts": self.counts.tolist(), "max_rate": self.max_rate}
+
+    def set_state(self, state: dict):
+        self.counts = np.array(state["counts"], dtype=np.int64)
+        self.max_rate = state["max_rate"]
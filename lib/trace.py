@@ -0,0 +1,100 @@
+import os
+import json
+from typing import Dict, Optional
+
+import numpy as np
+
+# one sample per shift update: step, imaginary time, shift, sum_i Ni H_0i, N0, total walker number Nw,
+# number of occupied determinants; the projected energy is numerator / N0
+TRACE_SCHEMA = (("step", "<i8"), ("tau", "<f8"), ("S", "<f8"), ("numerator", "<f8"), ("N0", "<f8"), ("Nw", "<f8"), ("dets", "<i8"))
+
+
+# read-only memory map of a column file written by a file-backed TraceSink
+def read_column(path: str, name: str) -> np.ndarray:
+    dtype = dict(TRACE_SCHEMA)[name]
+    file = os.path.join(path, f"{name}.bin")
+    if not os.path.exists(file) or os.path.getsize(file) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(file, dtype=dtype, mode="r")
+
+
+def read_trace(path: str) -> Dict[str, np.ndarray]:
+    return {name: read_column(path, name) for name, _ in TRACE_SCHEMA}
+
+
+class TraceSink:
+    # columnar store of the FCIQMC samples
+    # path None: in-memory columns growing geometrically
+    # otherwise: directory with one raw little-endian file per column, appended in chunks of chunk_rows samples,
+    # so only one chunk is held in memory; samples already in the files are kept until truncate
+    def __init__(self, path: Optional[str] = None, chunk_rows: int = 4096):
+        self.path: Optional[str] = path
+        self.chunk_rows: int = chunk_rows
+        self.stored: int = 0  # samples in the files
+        self.buffered: int = 0  # samples in the buffer
+        self.buffer: Dict[str, np.ndarray] = {name: np.zeros(chunk_rows, dtype=dtype) for name, dtype in TRACE_SCHEMA}
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, "schema.json"), "w") as file:
+                json.dump(TRACE_SCHEMA, file)
+            self.stored = len(read_column(path, "step"))
+
+    def __len__(self) -> int:
+        return self.stored + self.buffered
+
+    def append(self, step: int, tau: float, S: float, numerator: float, N0: float, Nw: float, dets: int):
+        if self.buffered == len(self.buffer["step"]):
+            if self.path is not None:
+                self.flush()
+            else:
+                self.grow(2 * self.buffered)
+        for (name, _), value in zip(TRACE_SCHEMA, (step, tau, S, numerator, N0, Nw, dets)):
+            self.buffer[name][self.buffered] = value
+        self.buffered += 1
+
+    # append whole columns, e.g. restored from a checkpoint
+    def extend(self, columns: Dict[str, np.ndarray]):
+        for row in zip(*(np.asarray(columns[name]).tolist() for name, _ in TRACE_SCHEMA)):
+            self.append(*row)
+
+    def grow(self, capacity: int):
+        for name, dtype in TRACE_SCHEMA:
+            column = np.zeros(max(capacity, 1), dtype=dtype)
+            column[: self.buffered] = self.buffer[name][: self.buffered]
+            self.buffer[name] = column
+
+    # move the buffered samples to the column files
+    def flush(self):
+        if self.path is None or self.buffered == 0:
+            return
+        for name, _ in TRACE_SCHEMA:
+            with open(os.path.join(self.path, f"{name}.bin"), "ab") as file:
+                file.write(self.buffer[name][: self.buffered].tobytes())
+        self.stored += self.buffered
+        self.buffered = 0
+
+    # keep the first size samples
+    def truncate(self, size: int):
+        self.flush()
+        if self.path is None:
+            self.buffered = min(self.buffered, size)
+            return
+        for name, dtype in TRACE_SCHEMA:
+            file = os.path.join(self.path, f"{name}.bin")
+            if os.path.exists(file):
+                os.truncate(file, min(size, self.stored) * np.dtype(dtype).itemsize)
+        self.stored = min(size, self.stored)
+
+    # view of a column: a slice of the in-memory column or a memory map of the file
+    def column(self, name: str) -> np.ndarray:
+        if self.path is None:
+            return self.buffer[name][: self.buffered]
+        self.flush()
+        return read_column(self.path, name)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        return {name: self.column(name) for name, _ in TRACE_SCHEMA}
+
+    # projected energy of every sample
+    def energy(self) -> np.ndarray:
+        return self.column("numerator") / self.column("N0")
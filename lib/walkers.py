@@ -0,0 +1,196 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .bitstring import *
+
+
+# sum spawns onto the same target: sort the targets and reduce each run of equal determinants
+# words: (S, K) target words; return unique sorted words, summed amplitudes,
+# whether any spawn onto the target came from an initiator, and the carried target diagonal energies
+def combine_spawns(words: np.ndarray, amps: np.ndarray, initiators: np.ndarray, diags: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    keys = det_keys(words)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    first = order[starts]
+    return (words[first], np.add.reduceat(amps[order], starts), np.logical_or.reduceat(initiators[order], starts), diags[first])
+
+
+# positions of (n, K) words in an array of determinant words sorted by det_keys, -1 where absent
+def search_sorted_dets(sorted_words: np.ndarray, words: np.ndarray) -> np.ndarray:
+    keys = det_keys(sorted_words)
+    targets = det_keys(words)
+    positions = np.searchsorted(keys, targets)
+    found = positions < len(keys)
+    found[found] = keys[positions[found]] == targets[found]
+    return np.where(found, positions, -1)
+
+
+class SpawnBuffer:
+    # preallocated store of the walkers spawned in one step, reused across steps
+    # records: structured array with fields
+    #   det: target determinant words (K uint64), see DetArray
+    #   amp: signed spawn amplitude
+    #   initiator: whether the parent was an initiator
+    #   diag: target diagonal energy Hjj, derived from the parent's Hii at spawn time
+    def __init__(self, nmo: int, capacity: int = 1024):
+        self.nmo: int = nmo
+        self.k: int = word_number(nmo)
+        self.dtype: np.dtype = np.dtype([("det", np.uint64, (self.k,)), ("amp", float), ("initiator", bool), ("diag", float)])
+        self.size: int = 0
+        self.records: np.ndarray = np.zeros(capacity, dtype=self.dtype)
+
+    def __len__(self) -> int:
+        return self.size
+
+    # enlarge storage geometrically, keeping the filled records
+    def grow(self, capacity: int):
+        if capacity <= len(self.records):
+            return
+        records = np.zeros(max(capacity, 2 * len(self.records)), dtype=self.dtype)
+        records[: self.size] = self.records[: self.size]
+        self.records = records
+
+    # copy a chunk of spawns into the buffer
+    def append(self, words: np.ndarray, amps: np.ndarray, initiators: np.ndarray, diags: np.ndarray):
+        m = len(amps)
+        if m == 0:
+            return
+        self.grow(self.size + m)
+        chunk = self.records[self.size : self.size + m]
+        chunk["det"] = words
+        chunk["amp"] = amps
+        chunk["initiator"] = initiators
+        chunk["diag"] = diags
+        self.size += m
+
+    # copy records of the buffer dtype, e.g. received from another process
+    def append_records(self, records: np.ndarray):
+        m = len(records)
+        if m == 0:
+            return
+        self.grow(self.size + m)
+        self.records[self.size : self.size + m] = records
+        self.size += m
+
+    def clear(self):
+        self.size = 0
+
+    # views of the filled part of the buffer: words (n, K), amplitudes, initiator flags, diagonal energies
+    def get_columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        records = self.records[: self.size]
+        return (records["det"], records["amp"], records["initiator"], records["diag"])
+
+
+class WalkerList:
+    # array-backed store of occupied determinants, kept sorted by det_keys
+    # dets: determinant words (capacity, K) uint64, see DetArray
+    # pops: signed walker populations
+    # diags: cached diagonal energies Hii
+    # refs: cached reference couplings H_0i (0 for determinants not connected to D0)
+    # core: determinants of the deterministic core space, kept even when their population is 0
+    columns = ("dets", "pops", "diags", "refs", "core")
+
+    def __init__(self, nmo: int, capacity: int = 1024):
+        self.nmo: int = nmo
+        self.k: int = word_number(nmo)
+        self.size: int = 0
+        self.dets: np.ndarray = np.zeros((capacity, self.k), dtype=np.uint64)
+        self.pops: np.ndarray = np.zeros(capacity, dtype=float)
+        self.diags: np.ndarray = np.zeros(capacity, dtype=float)
+        self.refs: np.ndarray = np.zeros(capacity, dtype=float)
+        self.core: np.ndarray = np.zeros(capacity, dtype=bool)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, bits: int) -> bool:
+        return self.find(bits) >= 0
+
+    # enlarge storage geometrically, keeping the occupied slots
+    def grow(self, capacity: int):
+        if capacity <= len(self.dets):
+            return
+        capacity = max(capacity, 2 * len(self.dets))
+        for name in self.columns:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    # slots of (n, K) determinant words, -1 where a determinant is not stored
+    def find_batch(self, words: np.ndarray) -> np.ndarray:
+        return search_sorted_dets(self.get_dets(), words)
+
+    # slot of a determinant, -1 if it is not stored
+    def find(self, bits: int) -> int:
+        return int(self.find_batch(int_to_words(bits, self.k)[None, :])[0])
+
+    # insert determinants that are not stored yet, words sorted by det_keys, in one merge pass
+    def merge(self, words: np.ndarray, pops: np.ndarray, diags: np.ndarray, refs: np.ndarray, core: Optional[np.ndarray] = None):
+        m = len(words)
+        if m == 0:
+            return
+        n = self.size
+        positions = np.searchsorted(det_keys(self.get_dets()), det_keys(words))
+        self.grow(n + m)
+        inserted = positions + np.arange(m)
+        kept = np.ones(n + m, dtype=bool)
+        kept[inserted] = False
+        core = np.zeros(m, dtype=bool) if core is None else core
+        for name, new in zip(self.columns, (words, pops, diags, refs, core)):
+            column = getattr(self, name)
+            merged = np.empty((n + m,) + column.shape[1:], dtype=column.dtype)
+            merged[kept] = column[:n]
+            merged[inserted] = new
+            column[: n + m] = merged
+        self.size = n + m
+
+    # insert a single determinant and return its slot
+    def add(self, bits: int, pop: float, diag: float, ref: float = 0.0) -> int:
+        if self.find(bits) >= 0:
+            raise ValueError(f"error: determinant {bits} is already stored")
+        self.merge(int_to_words(bits, self.k)[None, :], np.array([pop]), np.array([diag]), np.array([ref]))
+        return self.find(bits)
+
+    def get(self, bits: int) -> Tuple[float, float]:
+        slot = self.find(bits)
+        if slot < 0:
+            raise KeyError(bits)
+        return float(self.pops[slot]), float(self.diags[slot])
+
+    # remove dead slots (pop == 0, outside the core space) in place, keeping the sorted order
+    def compact(self):
+        n = self.size
+        alive = (self.pops[:n] != 0.0) | self.core[:n]
+        new_size = int(np.count_nonzero(alive))
+        if new_size == n:
+            return
+        for name in self.columns:
+            column = getattr(self, name)
+            column[:new_size] = column[:n][alive]
+        self.pops[new_size:n] = 0.0
+        self.core[new_size:n] = False
+        self.size = new_size
+
+    def clear(self):
+        self.size = 0
+        self.pops[:] = 0.0
+        self.core[:] = False
+
+    # views of the occupied part of the store
+    def get_dets(self) -> np.ndarray:
+        return self.dets[: self.size]
+
+    def get_pops(self) -> np.ndarray:
+        return self.pops[: self.size]
+
+    def get_diags(self) -> np.ndarray:
+        return self.diags[: self.size]
+
+    def get_refs(self) -> np.ndarray:
+        return self.refs[: self.size]
+
+    def get_core(self) -> np.ndarray:
+        return self.core[: self.size]
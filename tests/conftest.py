@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# FCIQMC params of a short run on the small test bases; keyword arguments override or add entries
+@pytest.fixture
+def make_params():
+    def make(**extra) -> dict:
+        params = {"initial_walkers": 10, "target_walker_number": 200, "d_tau": 1e-2, "A": 10, "xi": 0.1, "zeta": 0.01, "steps": 200, "initiator_threshold": 1, "seed": 1}
+        params.update(extra)
+        return params
+
+    return make
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from lib.fci import *
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = MatrixElementCache(2, "lru")
+    cache.put(1, 1.0)
+    cache.put(2, 2.0)
+    assert cache.get(1) == 1.0
+    cache.put(3, 3.0)
+    assert cache.get(2) is None
+    assert cache.get(1) == 1.0
+    assert cache.get(3) == 3.0
+    assert (cache.hits, cache.misses, cache.evictions) == (3, 1, 1)
+
+
+def test_fifo_evicts_the_oldest_inserted():
+    cache = MatrixElementCache(2, "fifo")
+    cache.put(1, 1.0)
+    cache.put(2, 2.0)
+    assert cache.get(1) == 1.0
+    cache.put(3, 3.0)
+    assert cache.get(1) is None
+    assert cache.get(2) == 2.0
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 1, 1)
+    assert len(cache) == 2
+    assert cache.hit_rate() == pytest.approx(2.0 / 3.0)
+
+
+def test_cache_rejects_bad_settings():
+    with pytest.raises(ValueError):
+        MatrixElementCache(0)
+    with pytest.raises(ValueError):
+        MatrixElementCache(4, "random")
+
+
+# a second FCI build is served from the cache and gives the same matrix; the batch paths of FCIQMC bypass it
+def test_hamiltonian_cache_hits():
+    basis = Basis(4, 1.0, 4)
+    hamiltonian = Hamiltonian(basis, 0.5, cache_size=100000)
+    matrices = []
+    for _ in range(2):
+        fci = FCI(basis, hamiltonian, 4)
+        fci.build_configurations()
+        fci.build_hamiltonian_matrix()
+        matrices.append(fci.hamil_matrix)
+    cache = hamiltonian.cache
+    elements = fci.dim * (fci.dim + 1) // 2
+    assert cache.misses == elements
+    assert cache.hits == elements
+    assert np.array_equal(matrices[0], matrices[1])
+    hits, misses = cache.hits, cache.misses
+    D = basis.minimum_det(4)
+    hamiltonian.Hmat1_batch(D, np.array([0, 1]), np.array([4, 5]))
+    assert (cache.hits, cache.misses) == (hits, misses)
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from lib.ccd import *
+from lib.mbpt import *
+
+
+# the pair-factorized equations are the full CCD equations restricted to the pair amplitudes, so both solvers take
+# the same iterates
+@pytest.mark.parametrize("p_max, n", [(4, 4), (6, 4), (6, 6)])
+@pytest.mark.parametrize("g", [-0.8, -0.3, 0.4, 1.0])
+def test_pair_ccd_reproduces_ccd(p_max, n, g):
+    basis = Basis(p_max, 1.0, n)
+    ccd = CCD(basis)
+    pair_ccd = PairCCD(basis)
+    energy = ccd.get_ccd(g)
+    assert energy is not None
+    assert abs(pair_ccd.get_ccd(g) - energy) < 1e-12
+    assert np.max(np.abs(pair_ccd.get_t2() - ccd.t2)) < 1e-12
+
+
+def test_pair_ccd_on_a_pair_basis():
+    energy = PairCCD(Basis(6, 1.0, 6)).get_ccd(0.5)
+    assert abs(PairCCD(PairBasis(6, 1.0, 6)).get_ccd(0.5) - energy) < 1e-12
+
+
+# continuing from converged amplitudes at the same g ends at the same energy, within the 1e-9 energy convergence
+def test_ccd_continuation():
+    basis = Basis(4, 1.0, 4)
+    ccd = CCD(basis)
+    energy = ccd.get_ccd(0.5)
+    assert abs(CCD(basis).get_ccd(0.5, ccd.t2) - energy) < 1e-8
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from lib.fciqmc import *
+
+
+def run(basis: Basis, hamiltonian: Hamiltonian, params: dict, checkpoint: Optional[str] = None) -> FCIQMC:
+    engine = FCIQMC(basis, hamiltonian, params, 4)
+    if checkpoint is None:
+        engine.warm()
+    else:
+        engine.load_checkpoint(checkpoint)
+    engine.start()
+    return engine
+
+
+# a run stopped at a checkpoint and resumed from it is bit for bit the run that never stopped, with the trace in
+# memory and in column files
+@pytest.mark.parametrize("file_trace", [False, True])
+def test_restart_reproduces_the_trace(tmp_path, make_params, file_trace):
+    basis = Basis(4, 1.0, 4)
+    hamiltonian = Hamiltonian(basis, 0.5)
+    path = str(tmp_path / "fciqmc.ckpt")
+    trace_path = str(tmp_path / "interrupted") if file_trace else None
+    reference = run(basis, hamiltonian, make_params(steps=400, trace_path=str(tmp_path / "reference") if file_trace else None))
+    run(basis, hamiltonian, make_params(steps=200, checkpoint_file=path, checkpoint_interval=200, trace_path=trace_path))
+    resumed = run(basis, hamiltonian, make_params(steps=400, trace_path=trace_path), checkpoint=path)
+    for name, column in reference.trace.columns().items():
+        assert np.array_equal(resumed.trace.column(name), column)
+    assert resumed.S == reference.S
+    assert np.array_equal(resumed.walkers.get_dets(), reference.walkers.get_dets())
+    assert np.array_equal(resumed.walkers.get_pops(), reference.walkers.get_pops())
+
+
+def test_checkpoint_file_round_trip(tmp_path, make_params):
+    basis = Basis(4, 1.0, 4)
+    engine = run(basis, Hamiltonian(basis, 0.5), make_params(steps=100))
+    path = str(tmp_path / "fciqmc.ckpt")
+    snapshot = take_snapshot(engine)
+    write_checkpoint(path, snapshot)
+    checkpoint = read_checkpoint(path)
+    for name in SECTIONS:
+        assert np.array_equal(checkpoint["arrays"][name], snapshot["arrays"][name])
+    assert checkpoint["header"]["S"] == engine.S
+    assert checkpoint["header"]["step_count"] == engine.step_count
+
+
+def test_foreign_file_is_rejected(tmp_path):
+    path = tmp_path / "not_a_checkpoint"
+    path.write_bytes(b"0123456789abcdef")
+    with pytest.raises(ValueError):
+        read_checkpoint(str(path))
@@ -0,0 +1,54 @@
+import os
+import signal
+
+import pytest
+
+from lib.fci import *
+from lib.sweep import *
+
+
+def make_fci(g: float) -> FCI:
+    basis = Basis(4, 1.0, 4)
+    fci = FCI(basis, Hamiltonian(basis, g), 4)
+    fci.build_configurations()
+    fci.build_hamiltonian_matrix()
+    return fci
+
+
+def test_davidson_matches_full_diagonalization():
+    fci = make_fci(0.5)
+    assert fci.solve_davidson()
+    assert fci.converged
+    assert abs(fci.emin - np.linalg.eigvalsh(fci.hamil_matrix)[0]) < 1e-8
+
+
+def test_davidson_rejects_guess_of_wrong_length():
+    fci = make_fci(0.5)
+    with pytest.raises(ValueError):
+        fci.solve_davidson(np.ones(fci.dim - 1))
+
+
+def test_davidson_reports_no_convergence():
+    fci = make_fci(0.5)
+    assert not fci.solve_davidson(max_iter=1)
+    assert not fci.converged
+
+
+def test_sweep_continues_from_converged_states():
+    g_list = np.linspace(-1.0, 1.0, 9)
+    energies = Sweep(g_list, processes=1).run(FCISolver(Basis(4, 1.0, 4), 4))
+    for g, energy in zip(g_list, energies):
+        assert abs(energy - np.linalg.eigvalsh(make_fci(g).hamil_matrix)[0]) < 1e-8
+
+
+class KilledSolver:
+    def solve(self, g: float, state: None):
+        if g > 0.0:
+            os.kill(os.getpid(), signal.SIGKILL)
+        return (g, None)
+
+
+# a worker killed mid-sweep makes run raise instead of waiting for its chunk forever
+def test_sweep_raises_for_a_killed_worker():
+    with pytest.raises(RuntimeError):
+        Sweep(np.linspace(-1.0, 1.0, 4), processes=2).run(KilledSolver())
@@ -0,0 +1,41 @@
+from lib.fciqmc import *
+
+
+# a generous steps is only the upper bound: the reblocking begins after a fixed equilibration and the run stops
+# as soon as the error at the plateau is small enough
+def test_target_error_stops_early(make_params):
+    basis = Basis(4, 1.0, 4)
+    engine = FCIQMC(basis, Hamiltonian(basis, 1.0), make_params(steps=40000, target_error=1e-2), 4)
+    engine.warm()
+    engine.start()
+    assert engine.stop_reason == "target_error"
+    assert engine.step_count < engine.steps // 3
+    E = engine.get_reblock_statistics()["E"]
+    assert E["optimal_level"] is not None
+    assert engine.reblock.counts[E["optimal_level"]] >= engine.target_error_blocks
+    assert E["error"] <= 1e-2
+
+
+# a run cut by time_limit leaves a checkpoint, and resuming from it ends exactly where the uninterrupted run does
+def test_time_limit_checkpoint_resumes(tmp_path, make_params):
+    basis = Basis(4, 1.0, 4)
+    hamiltonian = Hamiltonian(basis, 1.0)
+    path = str(tmp_path / "fciqmc.ckpt")
+    reference = FCIQMC(basis, hamiltonian, make_params(steps=1500), 4)
+    reference.warm()
+    reference.start()
+    assert reference.stop_reason == "steps"
+    limited = FCIQMC(basis, hamiltonian, make_params(steps=1500, time_limit=0.5, checkpoint_file=path), 4)
+    limited.warm()
+    limited.start()
+    assert limited.stop_reason == "time_limit"
+    assert 0 < limited.step_count < 1500
+    resumed = FCIQMC(basis, hamiltonian, make_params(steps=1500), 4)
+    resumed.load_checkpoint(path)
+    assert resumed.step_count == limited.step_count
+    resumed.start()
+    assert resumed.stop_reason == "steps"
+    assert resumed.step_count == 1500
+    for name, column in reference.trace.columns().items():
+        assert np.array_equal(resumed.trace.column(name), column)
+    assert resumed.S == reference.S
@@ -0,0 +1,80 @@
+import math
+import itertools
+
+import numpy as np
+import pytest
+
+from lib.fci import *
+
+
+# reference matrix elements from second quantization: H = sum_k h_k n_k + sum_{a<b, c<d} v_{abcd} a+_a a+_b a_d a_c,
+# with the sign of every operator counted explicitly over the occupied orbitals below it
+def apply_operators(bits: int, operators: list) -> Tuple[Optional[int], int]:
+    sign = 1
+    for creation, k in reversed(operators):
+        if bool((bits >> k) & 1) == creation:
+            return (None, 0)
+        sign *= -1 if bin(bits & ((1 << k) - 1)).count("1") % 2 else 1
+        bits ^= 1 << k
+    return (bits, sign)
+
+
+def reference_matrix(hamiltonian: Hamiltonian, configs: list) -> np.ndarray:
+    NMO = hamiltonian.NMO
+    index = {sum(1 << k for k in config): i for i, config in enumerate(configs)}
+    matrix = np.zeros((len(configs), len(configs)))
+    for bits, i in index.items():
+        matrix[i, i] += sum(hamiltonian.ch_v1mat[k] for k in range(NMO) if (bits >> k) & 1)
+        for (a, b), (c, d) in itertools.product(itertools.combinations(range(NMO), 2), repeat=2):
+            v = hamiltonian.find_v2mat(a, b, c, d)
+            if v != 0.0:
+                target, sign = apply_operators(bits, [(True, a), (True, b), (False, d), (False, c)])
+                if target is not None:
+                    matrix[index[target], i] += sign * v
+    return matrix
+
+
+# broken-pair sectors (odd n, or n = 4 of p_max = 5) are where the old phase, shifted without masking to NMO
+# bits, gave wrong signs
+@pytest.mark.parametrize("p_max, n", [(4, 2), (4, 3), (5, 4), (6, 3)])
+def test_fci_matrix_matches_second_quantization(p_max, n):
+    basis = Basis(p_max, 1.0, n)
+    hamiltonian = Hamiltonian(basis, 0.7)
+    fci = FCI(basis, hamiltonian, n)
+    fci.build_configurations()
+    fci.build_hamiltonian_matrix()
+    assert np.allclose(fci.hamil_matrix, reference_matrix(hamiltonian, fci.configs), atol=1e-12)
+
+
+@pytest.mark.parametrize("p_max, n", [(4, 3), (5, 4)])
+def test_batch_matrix_elements_match_second_quantization(p_max, n):
+    basis = Basis(p_max, 1.0, n)
+    hamiltonian = Hamiltonian(basis, 0.7)
+    configs = list(itertools.combinations(range(basis.NMO), n))
+    reference = reference_matrix(hamiltonian, configs)
+    index = {sum(1 << k for k in config): i for i, config in enumerate(configs)}
+    for bits, i in index.items():
+        D = Det.from_int(bits, basis.NMO)
+        occ = [k for k in range(basis.NMO) if (bits >> k) & 1]
+        free = [k for k in range(basis.NMO) if not (bits >> k) & 1]
+        a, b = np.array(list(itertools.product(occ, free))).T
+        expected = [reference[index[bits ^ (1 << x) ^ (1 << y)], i] for x, y in zip(a.tolist(), b.tolist())]
+        assert np.allclose(hamiltonian.Hmat1_batch(D, a, b), expected, atol=1e-12)
+        pairs = np.array([(x, y, z, w) for (x, y), (z, w) in itertools.product(itertools.combinations(occ, 2), itertools.combinations(free, 2))])
+        a, b, c, d = pairs.T
+        expected = [reference[index[bits ^ (1 << x) ^ (1 << y) ^ (1 << z) ^ (1 << w)], i] for x, y, z, w in pairs.tolist()]
+        assert np.allclose(hamiltonian.Hmat2_batch(D, a, b, c, d), expected, atol=1e-12)
+
+
+# the unpaired particles of a broken-pair state are blocked and their spins are free, so with n = 4 every seniority-2
+# level is 4-fold (seniority 4: 16-fold) degenerate and only the C(p_max, 2) seniority-0 levels are single; the old
+# phase split some of the 4-fold levels into pairs
+@pytest.mark.parametrize("p_max", [5, 6])
+def test_broken_pair_spectrum_degeneracy(p_max):
+    basis = Basis(p_max, 1.0, 4)
+    fci = FCI(basis, Hamiltonian(basis, 0.7), 4)
+    fci.build_configurations()
+    fci.build_hamiltonian_matrix()
+    _, multiplicities = np.unique(np.round(np.linalg.eigvalsh(fci.hamil_matrix), 8), return_counts=True)
+    assert np.sum(multiplicities == 1) == math.comb(p_max, 2)
+    assert np.all((multiplicities == 1) | (multiplicities % 4 == 0))
@@ -0,0 +1,95 @@
+import os
+import errno
+import signal
+import socket
+import time
+import multiprocessing as mp
+
+import pytest
+
+from lib.parallel import *
+from lib.distributed import *
+
+
+def test_partitioned_engine_is_abstract(make_params):
+    basis = Basis(4, 1.0, 4)
+    with pytest.raises(TypeError):
+        PartitionedFCIQMC(basis, Hamiltonian(basis, 0.5), make_params(), 4, 2)
+
+
+# a partitioned run would write one rank's slice of the walkers into the shared file
+def test_partitioned_checkpoint_is_rejected(tmp_path, make_params):
+    basis = Basis(4, 1.0, 4)
+    hamiltonian = Hamiltonian(basis, 0.5)
+    path = str(tmp_path / "parallel.ckpt")
+    with pytest.raises(ValueError):
+        ParallelFCIQMC(basis, hamiltonian, make_params(checkpoint_file=path, checkpoint_interval=50), 4, 2)
+    with pytest.raises(ValueError):
+        DistributedFCIQMC(basis, hamiltonian, make_params(checkpoint_file=path), 4, 0, [("127.0.0.1", 52000), ("127.0.0.1", 52001)])
+    engine = ParallelFCIQMC(basis, hamiltonian, make_params(), 4, 2)
+    engine.warm()
+    engine.start()
+    with pytest.raises(ValueError):
+        engine.save_checkpoint(path)
+    with pytest.raises(ValueError):
+        engine.load_checkpoint(path)
+    assert not os.path.exists(path)
+
+
+# rank 1 cannot bind its port and rank 0 waits for it in vain: both report, and the caller raises the bind error
+def test_distributed_bind_failure_is_raised(make_params):
+    basis = Basis(4, 1.0, 4)
+    blocker = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    blocker.bind(("127.0.0.1", 0))
+    blocker.listen(1)
+    port = blocker.getsockname()[1] - 1
+    try:
+        begin = time.time()
+        with pytest.raises(OSError) as error:
+            run_localhost(basis, Hamiltonian(basis, 0.5), make_params(), 4, 2, port=port, timeout=2.0)
+        assert error.value.errno == errno.EADDRINUSE
+        assert time.time() - begin < 30.0
+    finally:
+        blocker.close()
+
+
+def test_gather_results_raises_for_a_killed_process():
+    context = mp.get_context("fork")
+    results = context.Queue()
+    processes = [context.Process(target=results.put, args=(0,)), context.Process(target=lambda: os.kill(os.getpid(), signal.SIGKILL))]
+    for process in processes:
+        process.start()
+    with pytest.raises(RuntimeError):
+        gather_results(processes, results, poll=0.1)
+    for process in processes:
+        process.join()
+
+
+# first of two consecutive ports, probably free
+def free_port() -> int:
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port if port < 65535 else port - 1
+
+
+def parallel_trace(basis: Basis, hamiltonian: Hamiltonian, params: dict, processes: int, mailbox_capacity: int = 4096) -> Dict[str, np.ndarray]:
+    engine = ParallelFCIQMC(basis, hamiltonian, params, 4, processes, mailbox_capacity)
+    engine.warm()
+    engine.start()
+    return engine.trace.columns()
+
+
+# the same seed and process count give the same run, whatever carries the spawns: shared memory (in one or many
+# mailbox rounds) or TCP
+def test_partitioned_runs_are_identical(make_params):
+    basis = Basis(4, 1.0, 4)
+    hamiltonian = Hamiltonian(basis, 0.5)
+    params = make_params(steps=300)
+    reference = parallel_trace(basis, hamiltonian, params, 2)
+    assert len(reference["step"]) == 30
+    runs = [parallel_trace(basis, hamiltonian, params, 2), parallel_trace(basis, hamiltonian, params, 2, mailbox_capacity=2), run_localhost(basis, hamiltonian, params, 4, 2, port=free_port())]
+    for trace in runs:
+        for name, column in reference.items():
+            assert np.array_equal(trace[name], column), name
@@ -0,0 +1,27 @@
+import numpy as np
+
+from lib.fciqmc import *
+
+
+def test_suggestion_respects_the_diagonal_bound():
+    controller = TimeStepController(d_tau_max=1.0)
+    controller.record(np.full(100, 1e-3))
+    # the spawn rates alone would let d_tau double
+    assert controller.suggest(0.1) == 0.2
+    assert controller.suggest(0.1, diagonal_range=50.0) == 0.5 / 50.0
+    # without spawns yet, an initial d_tau that is too large is still cut
+    assert TimeStepController().suggest(0.1, diagonal_range=50.0) == 0.5 / 50.0
+
+
+# the diagonal range of a large pair space is far wider than its spawn rates suggest; an uncapped d_tau makes the
+# diagonal step 1 - d_tau (Hii - S) negative and the population explodes
+def test_adaptive_d_tau_stays_below_the_diagonal_bound(make_params):
+    basis = PairBasis(30, 1.0, 6)
+    engine = FCIQMC(basis, PairHamiltonian(basis, 0.5), make_params(d_tau=0.1, d_tau_control=True, initiator_threshold=3), 6)
+    for _ in range(50):
+        engine.step()
+        engine.annihilation()
+        engine.adjust_d_tau()
+        assert engine.d_tau * (engine.walkers.get_diags().max() - engine.S) <= engine.time_step.death_limit
+    assert engine.max_diagonal >= engine.walkers.get_diags().max()
+    assert engine.d_tau * (engine.max_diagonal - engine.S) <= engine.time_step.death_limit + 1e-12